@@ -1,33 +1,223 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, g
+from flask import Flask, render_template, request, redirect, url_for, flash, session, g, make_response, jsonify, Response
+import json
+import logging
 import sqlite3
 import os
+import threading
+import time
 from datetime import datetime, timedelta
-from werkzeug.utils import secure_filename
+from db import get_pool
+from migrations import current_version, migrate, pending_migrations
+from search import match_expression
+from availability import ensure_current
+import listings
+from facets import Filters, category_counts
+from pagination import PageRequest, paginate, page_url
+from cache import MISSING, SharedStore, TTLCache
+from ratings import record_review
+from timing import SectionTimer
+from querylog import InstrumentedConnection, QueryStats
+from messaging import send_message, mark_read
+from realtime import MessageBroker
+from images import InvalidImage, MAX_UPLOAD_BYTES, record_pending, stage_upload, srcsets, srcsets_for
+from jobs import enqueue, queue_stats, start_worker_thread
+import blobstore
+from assets import asset_url, send_asset
+from templating import RenderStats, configure_production
+from metrics import Metrics
+from profiling import RequestProfiler
 
 app = Flask(__name__)
-app.secret_key = 'your_secret_key'
+app.secret_key = os.environ.get('SECRET_KEY', 'your_secret_key')
 
-DATABASE = 'smart_neighborhood_exchange.db'
-UPLOAD_FOLDER = 'static/images'
+DATABASE = os.environ.get('DATABASE', 'smart_neighborhood_exchange.db')
+# gunicorn.conf.py sets this to the thread count
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+SLOW_CHECKOUT_MS = 100
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
+app.config['SERVER_TIMING'] = bool(os.environ.get('SERVER_TIMING'))
+app.config['APP_ENV'] = os.environ.get('APP_ENV', 'development')
+# Request profiling (profiling.py): send X-Profile: <PROFILE_TOKEN> to profile a
+# request, and/or profile this fraction of all requests
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.add_template_global(page_url)
+app.add_template_global(asset_url)
+
+# Render time per template, for profiling
+template_stats = RenderStats(app)
+
+# Opt-in sampling profiler, off unless PROFILE_TOKEN or PROFILE_SAMPLE_RATE is set
+profiler = RequestProfiler(app)
+
+# Homepage blocks are the same for every visitor and only change when a listing,
+# review or user name changes, so they are cached and invalidated by those writes.
+# CACHE_STORE names a file that shares the cache between worker processes
+# (gunicorn.conf.py sets one).
+HOMEPAGE_CACHE_TTL = 300
+homepage_cache = TTLCache(
+    'homepage', maxsize=8, ttl=HOMEPAGE_CACHE_TTL,
+    store=SharedStore(os.environ['CACHE_STORE']) if os.environ.get('CACHE_STORE') else None
+)
+
+# Wakes streaming conversation requests when a message for their user arrives
+message_broker = MessageBroker(DATABASE)
+STREAM_KEEPALIVE = 15    # seconds between keepalive comments on an idle stream
+STREAM_LIFETIME = 120    # seconds before a stream is closed; EventSource reconnects from its last event id
+LONG_POLL_TIMEOUT = 25   # seconds a long-poll request waits for a new message
+# Every open stream or long poll holds one of the worker's threads. At most this
+# many at once per worker, so ordinary requests (and /readyz) always get a
+# thread; clients over the cap get a 503 and poll /messages instead.
+MAX_LIVE_UPDATES = int(os.environ.get('MAX_LIVE_UPDATES', max(1, DB_POOL_SIZE // 2)))
+LIVE_UPDATES_RETRY_AFTER = 30
+live_update_slots = threading.BoundedSemaphore(MAX_LIVE_UPDATES)
 
 # Allowed file types for images
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+# Accept an uploaded image into the blob store (see blobstore.py), in the current
+# transaction. A new image is staged and a job queued to re-encode it and write
+# its thumbnails and WebP variants (see jobs.py); pages show a placeholder until
+# then. An image that is already stored just gains a reference. Returns the
+# image's path, or None if the upload is not a usable image.
+def save_image(upload):
+    if not upload or not allowed_file(upload.filename):
+        return None
+    try:
+        extension, staged_path, digest = stage_upload(upload.stream, blobstore.STAGING_FOLDER)
+    except InvalidImage:
+        return None
+    con = get_db()
+    image_path = blobstore.blob_path(digest, extension)
+    new = blobstore.add_reference(con, digest, image_path)
+    metrics.observe_upload(os.path.getsize(staged_path), new)
+    if new:
+        record_pending(con, image_path)
+        job_id = enqueue(con, 'process_image', {'staged_path': staged_path, 'folder': blobstore.blob_folder(digest), 'stem': digest})
+        # Deleted at the end of the request unless the request commits its job
+        g.setdefault('staged_uploads', []).append((job_id, staged_path))
+    else:
+        os.remove(staged_path)
+    return image_path
+
+# Drop a reference to an image that is no longer shown. Blobs are deleted by a job
+# once their last reference is gone; images from before the blob store are
+# deleted if nothing else uses them.
+def release_image(con, image_path):
+    if not image_path:
+        return
+    if blobstore.is_blob(image_path):
+        digest = blobstore.release(con, image_path)
+        if digest:
+            enqueue(con, 'delete_blob', {'digest': digest})
+    else:
+        enqueue(con, 'delete_image', {'image_path': image_path})
+
+# Delete staged uploads whose process_image job was not committed (the request
+# failed or changed its mind), so they do not pile up in the staging folder.
+# Call after the request's transaction has ended.
+def discard_uncommitted_uploads(con, staged_uploads):
+    for job_id, staged_path in staged_uploads:
+        row = con.execute("SELECT payload FROM Jobs WHERE job_id = ?", (job_id,)).fetchone()
+        committed = row is not None and json.loads(row[0]).get('staged_path') == staged_path
+        if not committed and os.path.exists(staged_path):
+            os.remove(staged_path)
+
+# Fingerprinted CSS/JS built by `python assets.py build`
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    return send_asset(filename)
+
+# Blob and variant names change whenever their content does, so browsers may keep them for a year
+@app.after_request
+def cache_blobs(response):
+    if request.path.startswith('/' + blobstore.BLOB_ROOT + '/') and response.status_code == 200:
+        response.headers['Cache-Control'] = blobstore.IMMUTABLE_CACHE_CONTROL
+    return response
+
+# srcset strings for an image, looked up once and then served from memory.
+# Placeholders are not cached: an image still being processed is looked up again
+# until its variants exist, and one that failed may be uploaded again under the
+# same blob path.
+image_srcsets = TTLCache('image_srcsets', maxsize=1024, ttl=3600)
+
+@app.template_global()
+def image_variants(image_path):
+    if not image_path:
+        return {}
+    preloaded = g.get('page_image_variants')
+    if preloaded is not None and image_path in preloaded:
+        return preloaded[image_path]
+    variants = image_srcsets.get(image_path)
+    if variants is MISSING:
+        variants = srcsets(get_db(), image_path)
+        if 'pending' not in variants and 'unavailable' not in variants:
+            image_srcsets.set(image_path, variants)
+    return variants
+
+# Look up the variants of every image a page shows before rendering it: cached
+# ones from memory, the rest with one query, instead of one query per image
+def preload_image_variants(image_paths):
+    preloaded = g.setdefault('page_image_variants', {})
+    missing = []
+    for image_path in set(filter(None, image_paths)) - preloaded.keys():
+        variants = image_srcsets.get(image_path)
+        if variants is MISSING:
+            missing.append(image_path)
+        else:
+            preloaded[image_path] = variants
+    if missing:
+        for image_path, variants in srcsets_for(get_db(), missing).items():
+            preloaded[image_path] = variants
+            if 'pending' not in variants and 'unavailable' not in variants:
+                image_srcsets.set(image_path, variants)
+
+# Prometheus metrics, served at /metrics
+metrics = Metrics(app, caches=(homepage_cache, image_srcsets), renders=template_stats)
+
+# Bring the schema up to date before serving any requests
+def run_migrations():
+    con = sqlite3.connect(DATABASE)
+    try:
+        for version, name in migrate(con):
+            app.logger.info("Applied migration %s: %s", version, name)
+    finally:
+        con.close()
+
+run_migrations()
+
+# This worker's connection pool. Its connections record the SQL each request runs.
+def get_db_pool():
+    return get_pool(DATABASE, DB_POOL_SIZE, InstrumentedConnection)
+
+# Borrow a warm connection from this worker's pool for the rest of the request
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
+        db, wait = get_db_pool().checkout()
+        g._database = db
+        g.db_checkout_wait = wait
+        metrics.observe_checkout(wait)
+        if wait * 1000 > SLOW_CHECKOUT_MS:
+            app.logger.warning("Waited %.1f ms for a database connection", wait * 1000)
     return db
 
+# Per-request SQL totals, slow-query log with plans and N+1 warnings
+query_stats = QueryStats(app, lambda: g.get('_database'))
+
+# Return the connection to the pool instead of closing it
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        # Anything the request did not commit is rolled back here
+        if db.in_transaction:
+            db.rollback()
+        discard_uncommitted_uploads(db, g.pop('staged_uploads', ()))
+        get_db_pool().checkin(db)
 
 # Helper function to get the user ID from the session
 def get_user_id():
@@ -98,13 +288,7 @@ def process_signup():
     location = request.form.get('address')
 
     # Handle profile image upload
-    profile_photo = request.files['profile_photo']
-    if profile_photo and allowed_file(profile_photo.filename):
-        filename = secure_filename(profile_photo.filename)
-        profile_photo_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        profile_photo.save(profile_photo_path)
-    else:
-        profile_photo_path = None
+    profile_photo_path = save_image(request.files['profile_photo'])
 
     # Insert new user data into the Users table
     con = get_db()
@@ -128,9 +312,8 @@ def confirm_registration():
 
 #------------------------------------------------------------------------------------------------------------------------------------
 
-# Home Page
-@app.route('/homepage')
-def homepage():
+# Query the data shown on the homepage
+def load_homepage_blocks():
     con = get_db()
 
     # Fetch the newest resource
@@ -160,106 +343,176 @@ def homepage():
         LIMIT 1
     """).fetchone()
 
-    # Fetch the top-rated users based on average review rating
+    # Fetch the top-rated users, ranked by their weighted rating score
     top_rated_users = con.execute("""
-        SELECT u.user_id, u.name, AVG(r.rating) as avg_rating
-        FROM Users u
-        JOIN Reviews r ON u.user_id = r.user_id
-        GROUP BY u.user_id
-        ORDER BY avg_rating DESC
+        SELECT u.user_id, u.name, 1.0 * rs.rating_sum / rs.review_count AS avg_rating
+        FROM RatingStats rs
+        JOIN Users u ON rs.subject_id = u.user_id
+        WHERE rs.subject_type = 'user'
+        ORDER BY rs.score DESC
         LIMIT 3
     """).fetchall()
 
-    return render_template(
-        'homepage.html',
-        newest_resource=newest_resource,
-        newest_space=newest_space,
-        newest_event=newest_event,
-        top_rated_users=top_rated_users
-    )
+    return {
+        'newest_resource': newest_resource,
+        'newest_space': newest_space,
+        'newest_event': newest_event,
+        'top_rated_users': top_rated_users,
+    }
+
+# Home Page
+@app.route('/homepage')
+def homepage():
+    blocks = homepage_cache.get_or_set('blocks', load_homepage_blocks)
+
+    return render_template('homepage.html', **blocks)
 
 # Dashboard Page
 @app.route('/dashboard')
 def dashboard():
     user_id = get_user_id()  # Function to get the current user's ID
+    timer = SectionTimer()
+    now = datetime.now()
+    last_24_hours = (now - timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')
+    today = now.strftime('%Y-%m-%d')
+
+    # One round trip for both sections: reservations made on the user's items in
+    # the last 24 hours (newest first), then the user's active and upcoming
+    # reservations and events (soonest first). Every arm starts from the user's
+    # own rows, so the cost does not grow with other users' activity.
+    with timer.section('db'):
+        con = get_db()
+        rows = con.execute("""
+            SELECT * FROM (
+                SELECT 'notification' AS section, 'Resource' AS kind, r.title, u.name, rr.created_at AS start_date, NULL AS end_date
+                FROM Resources r
+                JOIN ResourceReservations rr ON rr.resource_id = r.resource_id
+                JOIN Users u ON rr.user_id = u.user_id
+                WHERE r.user_id = ? AND rr.created_at >= ?
+                UNION ALL
+                SELECT 'notification', 'Space', s.title, u.name, sr.created_at, NULL
+                FROM Spaces s
+                JOIN SpaceReservations sr ON sr.space_id = s.space_id
+                JOIN Users u ON sr.user_id = u.user_id
+                WHERE s.user_id = ? AND sr.created_at >= ?
+                UNION ALL
+                SELECT 'notification', 'Event', e.title, u.name, ea.created_at, NULL
+                FROM Events e
+                JOIN EventAttendance ea ON ea.event_id = e.event_id
+                JOIN Users u ON ea.user_id = u.user_id
+                WHERE e.user_id = ? AND ea.created_at >= ?
+                UNION ALL
+                -- Reservations never end before they start, so "not ended yet" covers upcoming ones too
+                SELECT 'reservation', 'Resource', r.title, u.name, rr.reservation_start_date, rr.reservation_end_date
+                FROM ResourceReservations rr
+                JOIN Resources r ON rr.resource_id = r.resource_id
+                JOIN Users u ON r.user_id = u.user_id
+                WHERE rr.user_id = ? AND rr.reservation_end_date >= ?
+                UNION ALL
+                SELECT 'reservation', 'Space', s.title, u.name, sr.reservation_start_date, sr.reservation_end_date
+                FROM SpaceReservations sr
+                JOIN Spaces s ON sr.space_id = s.space_id
+                JOIN Users u ON s.user_id = u.user_id
+                WHERE sr.user_id = ? AND sr.reservation_end_date >= ?
+                UNION ALL
+                SELECT 'reservation', 'Event', e.title, u.name, e.date, NULL
+                FROM EventAttendance ea
+                JOIN Events e ON ea.event_id = e.event_id
+                JOIN Users u ON e.user_id = u.user_id
+                WHERE ea.user_id = ? AND e.date >= ?
+            )
+            ORDER BY section, CASE WHEN section = 'notification' THEN start_date END DESC, start_date
+        """, (user_id, last_24_hours) * 3 + (user_id, today) * 3).fetchall()
+
+    notifications = [(kind, title, name, created_at) for section, kind, title, name, created_at, _ in rows if section == 'notification']
+    reservations = [(kind, title, start_date, end_date, name) for section, kind, title, name, start_date, end_date in rows if section == 'reservation']
+
+    with timer.section('render'):
+        response = make_response(render_template(
+            'dashboard.html',
+            notifications=notifications,
+            reservations=reservations
+        ))
+
+    # Per-section timings for profiling, off unless SERVER_TIMING is set
+    if app.config['SERVER_TIMING']:
+        response.headers['Server-Timing'] = timer.header()
+    return response
+
+#----------------------------------------------------------------------------------------------------------------------------------
+
+"""
+Listing Routes
+
+Resources and spaces are both listings that can be reserved (see listings.py).
+Their pages share these views; only the kind, and with it the tables and
+templates, differs.
+"""
+
+# Other users' listings, newest first or ranked by the search box
+def view_listings(kind):
+    user_id = get_user_id()
+    search_match = match_expression(request.args.get('query', ''))  # Full-text query for the search box
+    con = get_db()
+    ensure_current(con)  # Roll the Reserved status over to today if needed
+    filters = Filters(request.args)  # Category, owner, posted-since and free-dates filters
+    page = listings.browse(con, kind, user_id, search_match, filters)
+    preload_image_variants(row[4] for row in page.rows)
+    return render_template(f'{kind.plural}/view_{kind.plural}.html', page=page, filters=filters,
+                           categories=category_counts(con, kind.name, user_id), **{kind.plural: page.rows})
+
+# Reservation form for an item, and booking it
+def reserve_listing(kind, item_id):
+    user_id = get_user_id()
     con = get_db()
+    today = datetime.now().date().strftime('%Y-%m-%d')
+    template = f'{kind.plural}/reserve_{kind.name}.html'
+    existing_reservations = listings.upcoming_reservations(con, kind, item_id, today)
 
-    # Get notifications for reservations made in the last 24 hours
-    last_24_hours = (datetime.now() - timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')
-    notifications = []
-
-    # Fetch ResourceReservations notifications with user names
-    resource_notifications = con.execute('''
-        SELECT r.title, u.name, rr.created_at
-        FROM ResourceReservations rr
-        JOIN Resources r ON rr.resource_id = r.resource_id
-        JOIN Users u ON rr.user_id = u.user_id
-        WHERE r.user_id = ? AND rr.created_at >= ?
-    ''', (user_id, last_24_hours)).fetchall()
-    notifications.extend([("Resource", title, user_name, created_at) for title, user_name, created_at in resource_notifications])
-
-    # Fetch SpaceReservations notifications with user names
-    space_notifications = con.execute('''
-        SELECT s.title, u.name, sr.created_at
-        FROM SpaceReservations sr
-        JOIN Spaces s ON sr.space_id = s.space_id
-        JOIN Users u ON sr.user_id = u.user_id
-        WHERE s.user_id = ? AND sr.created_at >= ?
-    ''', (user_id, last_24_hours)).fetchall()
-    notifications.extend([("Space", title, user_name, created_at) for title, user_name, created_at in space_notifications])
-
-    # Fetch EventAttendance notifications with user names
-    event_notifications = con.execute('''
-        SELECT e.title, u.name, ea.created_at
-        FROM EventAttendance ea
-        JOIN Events e ON ea.event_id = e.event_id
-        JOIN Users u ON ea.user_id = u.user_id
-        WHERE e.user_id = ? AND ea.created_at >= ?
-    ''', (user_id, last_24_hours)).fetchall()
-    notifications.extend([("Event", title, user_name, created_at) for title, user_name, created_at in event_notifications])
-
-    # Get user's active and upcoming reservations
-    reservations = []
-
-    # Fetch active and upcoming resource reservations with owner names
-    resource_reservations = con.execute('''
-        SELECT r.title, rr.reservation_start_date, rr.reservation_end_date, u.name
-        FROM ResourceReservations rr
-        JOIN Resources r ON rr.resource_id = r.resource_id
-        JOIN Users u ON r.user_id = u.user_id
-        WHERE rr.user_id = ? AND (
-            rr.reservation_end_date >= ? OR rr.reservation_start_date >= ?
-        )
-    ''', (user_id, datetime.now().strftime('%Y-%m-%d'), datetime.now().strftime('%Y-%m-%d'))).fetchall()
-    reservations.extend([("Resource", title, start_date, end_date, reserved_from) for title, start_date, end_date, reserved_from in resource_reservations])
+    if request.method == 'POST':
+        # Convert the reservation dates from the form to date objects
+        start_date = datetime.strptime(request.form.get('start_date'), '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.form.get('end_date'), '%Y-%m-%d').date()
 
-    # Fetch active and upcoming space reservations with owner names
-    space_reservations = con.execute('''
-        SELECT s.title, sr.reservation_start_date, sr.reservation_end_date, u.name
-        FROM SpaceReservations sr
-        JOIN Spaces s ON sr.space_id = s.space_id
-        JOIN Users u ON s.user_id = u.user_id
-        WHERE sr.user_id = ? AND (
-            sr.reservation_end_date >= ? OR sr.reservation_start_date >= ?
-        )
-    ''', (user_id, datetime.now().strftime('%Y-%m-%d'), datetime.now().strftime('%Y-%m-%d'))).fetchall()
-    reservations.extend([("Space", title, start_date, end_date, reserved_from) for title, start_date, end_date, reserved_from in space_reservations])
+        # Validate that the end date is not earlier than the start date
+        if end_date < start_date:
+            error_message = "The end date cannot be earlier than the start date. Please choose valid dates."
+            return render_template(template, error_message=error_message,
+                                   existing_reservations=existing_reservations, **{kind.id_column: item_id})
 
-    # Fetch active and upcoming event attendances
-    event_attendances = con.execute('''
-        SELECT e.title, e.date, u.name
-        FROM EventAttendance ea
-        JOIN Events e ON ea.event_id = e.event_id
-        JOIN Users u ON e.user_id = u.user_id
-        WHERE ea.user_id = ? AND e.date >= ?
-    ''', (user_id, datetime.now().strftime('%Y-%m-%d'))).fetchall()
-    reservations.extend([("Event", title, start_date, None, organizer) for title, start_date, organizer in event_attendances])
-
-    return render_template(
-        'dashboard.html',
-        notifications=notifications,
-        reservations=reservations
-    )
+        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        conflicts = listings.reserve(con, kind, item_id, user_id, start_date.isoformat(), end_date.isoformat(),
+                                     created_at, today)
+        if conflicts:
+            error_message = "The selected dates overlap with an existing reservation. Please choose different dates."
+            return render_template(template, error_message=error_message,
+                                   existing_reservations=conflicts, **{kind.id_column: item_id})
+        return redirect(url_for(f'reserved_{kind.plural}'))
+
+    # Render form for GET request
+    return render_template(template, existing_reservations=existing_reservations, **{kind.id_column: item_id})
+
+# Cancel one of the user's reservations
+def cancel_listing_reservation(kind, reservation_id):
+    today = datetime.now().date().strftime('%Y-%m-%d')
+    if listings.cancel(get_db(), kind, reservation_id, get_user_id(), today):
+        flash("Reservation cancelled successfully.")
+    else:
+        flash("You do not have permission to cancel this reservation.")
+    return redirect(url_for(f'reserved_{kind.plural}'))
+
+# The user's reservations, with each item's owner
+def reserved_listings(kind):
+    reservations = listings.user_reservations(get_db(), kind, get_user_id())
+    return render_template(f'{kind.plural}/reserved_{kind.plural}.html', reservations=reservations)
+
+# The user's own listings
+def my_listings(kind):
+    con = get_db()
+    ensure_current(con)  # Roll the Reserved status over to today if needed
+    rows = listings.owned(con, kind, get_user_id())
+    preload_image_variants(row[4] for row in rows)
+    return render_template(f'{kind.plural}/my_{kind.plural}.html', **{kind.plural: rows})
 
 #----------------------------------------------------------------------------------------------------------------------------------
 
@@ -275,146 +528,17 @@ def resources_home():
 # View Resources
 @app.route('/view-resources')
 def view_resources():
-    user_id = get_user_id()  # Get the current user's ID
-    search_query = request.args.get('query', '')  # Get the search query
-    today = datetime.now().date().strftime('%Y-%m-%d')  # Fetch today's date
-
-    con = get_db()
-    if search_query:
-        # Search query - filter results by user_name, title, description, category, or availability
-        cur = con.execute("""
-            SELECT r.resource_id, u.name AS user_name, r.title, r.description, r.images, r.category, 
-                   CASE
-                       WHEN EXISTS (
-                           SELECT 1 FROM ResourceReservations rr
-                           WHERE rr.resource_id = r.resource_id
-                           AND DATE(rr.reservation_start_date) <= ?
-                           AND DATE(rr.reservation_end_date) >= ?
-                       ) THEN 'Reserved'
-                       ELSE r.availability
-                   END AS availability,
-                   r.date_posted
-            FROM Resources r
-            JOIN Users u ON r.user_id = u.user_id
-            WHERE r.user_id != ?
-            AND (
-                u.name LIKE ?
-                OR r.title LIKE ?
-                OR r.description LIKE ?
-                OR r.category LIKE ?
-                OR r.availability LIKE ?
-            )
-        """, (today, today, user_id, f'%{search_query}%', f'%{search_query}%', f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'))
-    else:
-        # No search query - show all resources not belonging to the current user
-        cur = con.execute("""
-            SELECT r.resource_id, u.name AS user_name, r.title, r.description, r.images, r.category, 
-                   CASE
-                       WHEN EXISTS (
-                           SELECT 1 FROM ResourceReservations rr
-                           WHERE rr.resource_id = r.resource_id
-                           AND DATE(rr.reservation_start_date) <= ?
-                           AND DATE(rr.reservation_end_date) >= ?
-                       ) THEN 'Reserved'
-                       ELSE r.availability
-                   END AS availability,
-                   r.date_posted
-            FROM Resources r
-            JOIN Users u ON r.user_id = u.user_id
-            WHERE r.user_id != ?
-        """, (today, today, user_id))
-
-    other_resources = cur.fetchall()
-    return render_template('resources/view_resources.html', resources=other_resources)
+    return view_listings(listings.RESOURCES)
 
 # Reserve Resource
 @app.route('/reserve-resource/<int:resource_id>', methods=['GET', 'POST'])
 def reserve_resource(resource_id):
-    user_id = get_user_id()
-    con = get_db()
-
-    # Fetch existing reservations for the resource
-    cur = con.execute("""
-        SELECT reservation_start_date, reservation_end_date 
-        FROM ResourceReservations 
-        WHERE resource_id = ?
-    """, (resource_id,))
-    existing_reservations = cur.fetchall()
-
-    if request.method == 'POST':
-        # Get reservation dates from form input
-        start_date_str = request.form.get('start_date')
-        end_date_str = request.form.get('end_date')
-
-        # Convert date strings to date objects
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-
-        # Validate that the end date is not earlier than the start date
-        if end_date < start_date:
-            error_message = "The end date cannot be earlier than the start date. Please choose valid dates."
-            return render_template(
-                'resources/reserve_resource.html',
-                resource_id=resource_id,
-                error_message=error_message,
-                existing_reservations=existing_reservations
-            )
-
-        # Validate that the selected dates do not overlap with existing reservations
-        for reservation in existing_reservations:
-            res_start = datetime.strptime(reservation[0], '%Y-%m-%d').date()
-            res_end = datetime.strptime(reservation[1], '%Y-%m-%d').date()
-
-            # Check for overlap
-            if start_date <= res_end and end_date >= res_start:
-                error_message = "The selected dates overlap with an existing reservation. Please choose different dates."
-                return render_template(
-                    'resources/reserve_resource.html',
-                    resource_id=resource_id,
-                    error_message=error_message,
-                    existing_reservations=existing_reservations
-                )
-
-        # Add a created_at timestamp
-        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        # If no overlap and valid dates, proceed with the reservation
-        con.execute(
-            """
-            INSERT INTO ResourceReservations (
-                resource_id, user_id, reservation_start_date, reservation_end_date, created_at
-            ) VALUES (?, ?, ?, ?, ?)
-            """,
-            (resource_id, user_id, start_date_str, end_date_str, created_at)
-        )
-        con.commit()
-        return redirect(url_for('reserved_resources'))
-
-    # Render form for GET request
-    return render_template('resources/reserve_resource.html', resource_id=resource_id, existing_reservations=existing_reservations)
+    return reserve_listing(listings.RESOURCES, resource_id)
 
 # Cancel resource reservation
 @app.route('/cancel-resource-reservation/<int:reservation_id>', methods=['POST'])
 def cancel_reservation(reservation_id):
-    user_id = get_user_id()
-    con = get_db()
-
-    # Retrieve the resource ID to update availability later
-    cur = con.execute("SELECT resource_id FROM ResourceReservations WHERE reservation_id = ? AND user_id = ?", (reservation_id, user_id))
-    reservation = cur.fetchone()
-    
-    if reservation:
-        resource_id = reservation[0]
-        # Delete the reservation from the ResourceReservations table
-        con.execute("DELETE FROM ResourceReservations WHERE reservation_id = ? AND user_id = ?", (reservation_id, user_id))
-        # Update the resource's availability back to 'available'
-        con.execute("UPDATE Resources SET availability = 'available' WHERE resource_id = ?", (resource_id,))
-        con.commit()
-        flash("Reservation cancelled successfully.")
-    else:
-        flash("You do not have permission to cancel this reservation.")
-    
-    return redirect(url_for('reserved_resources'))
+    return cancel_listing_reservation(listings.RESOURCES, reservation_id)
 
 # Edit Resource
 @app.route('/edit-resource/<int:resource_id>', methods=['GET', 'POST'])
@@ -433,6 +557,7 @@ def edit_resource(resource_id):
             (title, description, category, availability, resource_id, user_id)
         )
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
         flash("Resource updated successfully!")
         return redirect(url_for('my_resources'))
 
@@ -452,8 +577,12 @@ def confirm_delete_resource(resource_id):
     
     if request.method == 'POST':
         # Delete the resource from the database
+        image = con.execute("SELECT images FROM Resources WHERE resource_id = ? AND user_id = ?", (resource_id, user_id)).fetchone()
         con.execute("DELETE FROM Resources WHERE resource_id = ? AND user_id = ?", (resource_id, user_id))
+        if image:
+            release_image(con, image[0])
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
         flash("Resource deleted successfully!")
         return redirect(url_for('my_resources'))
     
@@ -471,18 +600,7 @@ def confirm_delete_resource(resource_id):
 # Reserved Resources
 @app.route('/reserved-resources')
 def reserved_resources():
-    user_id = get_user_id()
-    con = get_db()
-    # Fetch the user's active reservations and related resource details, including the owner's name
-    cur = con.execute("""
-        SELECT rr.reservation_id, r.title, rr.reservation_start_date, rr.reservation_end_date, u.name AS reserved_from
-        FROM ResourceReservations rr
-        JOIN Resources r ON rr.resource_id = r.resource_id
-        JOIN Users u ON r.user_id = u.user_id
-        WHERE rr.user_id = ?
-    """, (user_id,))
-    reservations = cur.fetchall()
-    return render_template('resources/reserved_resources.html', reservations=reservations)
+    return reserved_listings(listings.RESOURCES)
 
 # Add New Resource
 @app.route('/new-resource', methods=['GET', 'POST'])
@@ -496,14 +614,8 @@ def new_resource():
         date_posted = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
         # Handle image upload
-        image = request.files['image']
-        if image and allowed_file(image.filename):
-            filename = secure_filename(image.filename)
-            # Ensure upload folder exists
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename).replace("\\", "/")
-            image.save(image_path)
-        else:
+        image_path = save_image(request.files['image'])
+        if image_path is None:
             flash("Invalid image file. Please upload a PNG, JPG, JPEG, or GIF file.")
             return redirect(url_for('new_resource'))
 
@@ -514,6 +626,7 @@ def new_resource():
             (user_id, title, description, image_path, category, availability, date_posted)
         )
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
 
         flash("Resource added successfully!")
         return redirect(url_for('my_resources'))
@@ -523,32 +636,7 @@ def new_resource():
 # My Resources
 @app.route('/my-resources')
 def my_resources():
-    user_id = get_user_id()
-    con = get_db()
-
-    # Fetch today's date
-    today = datetime.now().date().strftime('%Y-%m-%d')
-
-    # Query to fetch all resources owned by the user
-    cur = con.execute("""
-        SELECT r.resource_id, r.user_id, r.title, r.description, r.images, r.category, 
-               CASE
-                   WHEN EXISTS (
-                       SELECT 1 FROM ResourceReservations rr
-                       WHERE rr.resource_id = r.resource_id
-                       AND DATE(rr.reservation_start_date) <= ?
-                       AND DATE(rr.reservation_end_date) >= ?
-                   ) THEN 'Reserved'
-                   ELSE r.availability
-               END AS availability,
-               r.date_posted
-        FROM Resources r
-        WHERE r.user_id = ?
-    """, (today, today, user_id))
-    
-    resources = cur.fetchall()
-
-    return render_template('resources/my_resources.html', resources=resources)
+    return my_listings(listings.RESOURCES)
 
 #----------------------------------------------------------------------------------------------------------------------------------
 
@@ -564,146 +652,17 @@ def spaces_home():
 # View Spaces
 @app.route('/view-spaces')
 def view_spaces():
-    user_id = get_user_id()  # Get the current user's ID
-    search_query = request.args.get('query', '')  # Get the search query
-    today = datetime.now().date().strftime('%Y-%m-%d')  # Fetch today's date
-
-    con = get_db()
-    if search_query:
-        # Search query - filter results by user_name, title, description, category, or availability
-        cur = con.execute("""
-            SELECT s.space_id, u.name AS user_name, s.title, s.description, s.images, s.category, 
-                   CASE
-                       WHEN EXISTS (
-                           SELECT 1 FROM SpaceReservations sr
-                           WHERE sr.space_id = s.space_id
-                           AND DATE(sr.reservation_start_date) <= ?
-                           AND DATE(sr.reservation_end_date) >= ?
-                       ) THEN 'Reserved'
-                       ELSE s.availability
-                   END AS availability,
-                   s.date_posted
-            FROM Spaces s
-            JOIN Users u ON s.user_id = u.user_id
-            WHERE s.user_id != ?
-            AND (
-                u.name LIKE ?
-                OR s.title LIKE ?
-                OR s.description LIKE ?
-                OR s.category LIKE ?
-                OR s.availability LIKE ?
-            )
-        """, (today, today, user_id, f'%{search_query}%', f'%{search_query}%', f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'))
-    else:
-        # No search query - show all spaces not belonging to the current user
-        cur = con.execute("""
-            SELECT s.space_id, u.name AS user_name, s.title, s.description, s.images, s.category, 
-                   CASE
-                       WHEN EXISTS (
-                           SELECT 1 FROM SpaceReservations sr
-                           WHERE sr.space_id = s.space_id
-                           AND DATE(sr.reservation_start_date) <= ?
-                           AND DATE(sr.reservation_end_date) >= ?
-                       ) THEN 'Reserved'
-                       ELSE s.availability
-                   END AS availability,
-                   s.date_posted
-            FROM Spaces s
-            JOIN Users u ON s.user_id = u.user_id
-            WHERE s.user_id != ?
-        """, (today, today, user_id))
-
-    other_spaces = cur.fetchall()
-    return render_template('spaces/view_spaces.html', spaces=other_spaces)
+    return view_listings(listings.SPACES)
 
 # Reserve Space
 @app.route('/reserve-space/<int:space_id>', methods=['GET', 'POST'])
 def reserve_space(space_id):
-    user_id = get_user_id()
-    con = get_db()
-
-    # Fetch existing reservations for the space
-    cur = con.execute("""
-        SELECT reservation_start_date, reservation_end_date 
-        FROM SpaceReservations 
-        WHERE space_id = ?
-    """, (space_id,))
-    existing_reservations = cur.fetchall()
-
-    if request.method == 'POST':
-        # Get reservation dates from form input
-        start_date_str = request.form.get('start_date')
-        end_date_str = request.form.get('end_date')
-
-        # Convert date strings to date objects
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
-
-        # Validate that the end date is not earlier than the start date
-        if end_date < start_date:
-            error_message = "The end date cannot be earlier than the start date. Please choose valid dates."
-            return render_template(
-                'spaces/reserve_space.html',
-                space_id=space_id,
-                error_message=error_message,
-                existing_reservations=existing_reservations
-            )
-
-        # Validate that the selected dates do not overlap with existing reservations
-        for reservation in existing_reservations:
-            res_start = datetime.strptime(reservation[0], '%Y-%m-%d').date()
-            res_end = datetime.strptime(reservation[1], '%Y-%m-%d').date()
-
-            # Check for overlap
-            if start_date <= res_end and end_date >= res_start:
-                error_message = "The selected dates overlap with an existing reservation. Please choose different dates."
-                return render_template(
-                    'spaces/reserve_space.html',
-                    space_id=space_id,
-                    error_message=error_message,
-                    existing_reservations=existing_reservations
-                )
-
-        # Add a created_at timestamp
-        created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        # If no overlap and valid dates, proceed with the reservation
-        con.execute(
-            """
-            INSERT INTO SpaceReservations (
-                space_id, user_id, reservation_start_date, reservation_end_date, created_at
-            ) VALUES (?, ?, ?, ?, ?)
-            """,
-            (space_id, user_id, start_date_str, end_date_str, created_at)
-        )
-        con.commit()
-        return redirect(url_for('reserved_spaces'))
-
-    # Render form for GET request
-    return render_template('spaces/reserve_space.html', space_id=space_id, existing_reservations=existing_reservations)
+    return reserve_listing(listings.SPACES, space_id)
 
 # Cancel Space Reservation
 @app.route('/cancel-space-reservation/<int:reservation_id>', methods=['POST'])
 def cancel_space_reservation(reservation_id):
-    user_id = get_user_id()
-    con = get_db()
-
-    # Retrieve the space ID to update availability later
-    cur = con.execute("SELECT space_id FROM SpaceReservations WHERE reservation_id = ? AND user_id = ?", (reservation_id, user_id))
-    reservation = cur.fetchone()
-    
-    if reservation:
-        space_id = reservation[0]
-        # Delete the reservation from the SpaceReservations table
-        con.execute("DELETE FROM SpaceReservations WHERE reservation_id = ? AND user_id = ?", (reservation_id, user_id))
-        # Update the space's availability back to 'available'
-        con.execute("UPDATE Spaces SET availability = 'available' WHERE space_id = ?", (space_id,))
-        con.commit()
-        flash("Reservation cancelled successfully.")
-    else:
-        flash("You do not have permission to cancel this reservation.")
-    
-    return redirect(url_for('reserved_spaces'))
+    return cancel_listing_reservation(listings.SPACES, reservation_id)
 
 # Edit Space
 @app.route('/edit-space/<int:space_id>', methods=['GET', 'POST'])
@@ -722,6 +681,7 @@ def edit_space(space_id):
             (title, description, category, availability, space_id, user_id)
         )
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
         flash("Space updated successfully!")
         return redirect(url_for('my_spaces'))
 
@@ -741,8 +701,12 @@ def confirm_delete_space(space_id):
     
     if request.method == 'POST':
         # Delete the space from the database
+        image = con.execute("SELECT images FROM Spaces WHERE space_id = ? AND user_id = ?", (space_id, user_id)).fetchone()
         con.execute("DELETE FROM Spaces WHERE space_id = ? AND user_id = ?", (space_id, user_id))
+        if image:
+            release_image(con, image[0])
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
         flash("Space deleted successfully!")
         return redirect(url_for('my_spaces'))
     
@@ -760,18 +724,7 @@ def confirm_delete_space(space_id):
 # Reserved Spaces 
 @app.route('/reserved-spaces')
 def reserved_spaces():
-    user_id = get_user_id()
-    con = get_db()
-    # Fetch the user's active reservations and related space details, including the owner's name
-    cur = con.execute("""
-        SELECT sr.reservation_id, s.title, sr.reservation_start_date, sr.reservation_end_date, u.name AS reserved_from
-        FROM SpaceReservations sr
-        JOIN Spaces s ON sr.space_id = s.space_id
-        JOIN Users u ON s.user_id = u.user_id
-        WHERE sr.user_id = ?
-    """, (user_id,))
-    reservations = cur.fetchall()
-    return render_template('spaces/reserved_spaces.html', reservations=reservations)
+    return reserved_listings(listings.SPACES)
 
 # Add New Space
 @app.route('/new-space', methods=['GET', 'POST'])
@@ -785,14 +738,8 @@ def new_space():
         date_posted = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
         # Handle image upload
-        image = request.files['image']
-        if image and allowed_file(image.filename):
-            filename = secure_filename(image.filename)
-            # Ensure upload folder exists
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename).replace("\\", "/")
-            image.save(image_path)
-        else:
+        image_path = save_image(request.files['image'])
+        if image_path is None:
             flash("Invalid image file. Please upload a PNG, JPG, JPEG, or GIF file.")
             return redirect(url_for('new_space'))
 
@@ -803,6 +750,7 @@ def new_space():
             (user_id, title, description, image_path, category, availability, date_posted)
         )
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
 
         flash("Space added successfully!")
         return redirect(url_for('my_spaces'))
@@ -812,28 +760,7 @@ def new_space():
 # My Spaces route
 @app.route('/my-spaces')
 def my_spaces():
-    user_id = get_user_id()  # Get the current user's ID
-    today = datetime.now().date().strftime('%Y-%m-%d')  # Fetch today's date
-
-    con = get_db()
-    cur = con.execute("""
-        SELECT s.space_id, s.user_id, s.title, s.description, s.images, s.category, 
-               CASE
-                   WHEN EXISTS (
-                       SELECT 1 FROM SpaceReservations sr
-                       WHERE sr.space_id = s.space_id
-                       AND DATE(sr.reservation_start_date) <= ?
-                       AND DATE(sr.reservation_end_date) >= ?
-                   ) THEN 'Reserved'
-                   ELSE s.availability
-               END AS availability,
-               s.date_posted
-        FROM Spaces s
-        WHERE s.user_id = ?
-    """, (today, today, user_id))
-
-    spaces = cur.fetchall()
-    return render_template('spaces/my_spaces.html', spaces=spaces)
+    return my_listings(listings.SPACES)
 
 #----------------------------------------------------------------------------------------------------------------------------------
 """
@@ -850,34 +777,47 @@ def events_home():
 def view_events():
     user_id = get_user_id()  # Get the current user's ID
     search_query = request.args.get('query', '')  # Get the search query
+    search_match = match_expression(search_query)  # Full-text query for the search box
+
+    filters = Filters(request.args)  # Category, organizer and date-range filters
+    today = datetime.now().date().strftime('%Y-%m-%d')
+
+    # Only future events, narrowed by the filters that are set
+    where = " AND e.date >= ?"
+    params = [max(filters.date_from or today, today)]
+    if filters.date_to:
+        where += " AND e.date <= ?"
+        params.append(filters.date_to)
+    if filters.category:
+        where += " AND e.category = ?"
+        params.append(filters.category)
+    if filters.owner is not None:
+        where += " AND e.user_id = ?"
+        params.append(filters.owner)
 
     con = get_db()
-    if search_query:
-        # Search query - filter results by user_name, title, description, or category
-        cur = con.execute("""
-            SELECT e.event_id, u.name AS user_name, e.title, e.description, e.images, e.category, e.date 
-            FROM Events e
+    if search_match:
+        # Search query - ranked full-text match on user_name, title, description, or category
+        page = paginate(con, """
+            SELECT e.event_id, u.name AS user_name, e.title, e.description, e.images, e.category, e.date, EventsFTS.rank AS rank
+            FROM EventsFTS
+            JOIN Events e ON e.event_id = EventsFTS.rowid
             JOIN Users u ON e.user_id = u.user_id
-            WHERE e.user_id != ?
-            AND e.date >= date('now')  -- Only future events
-            AND (
-                u.name LIKE ?
-                OR e.title LIKE ?
-                OR e.description LIKE ?
-                OR e.category LIKE ?
-            )
-        """, (user_id, f'%{search_query}%', f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'))
+            WHERE EventsFTS MATCH ?
+            AND e.user_id != ?
+        """ + where, [search_match, user_id] + params, ['rank', 'event_id'], descending=False, hidden=['rank'])
     else:
-        # No search query - show all future events not belonging to the current user
-        cur = con.execute("""
-            SELECT e.event_id, u.name AS user_name, e.title, e.description, e.images, e.category, e.date 
+        # No search query - show all future events not belonging to the current user, soonest first
+        page = paginate(con, """
+            SELECT e.event_id, u.name AS user_name, e.title, e.description, e.images, e.category, e.date
             FROM Events e
             JOIN Users u ON e.user_id = u.user_id
-            WHERE e.user_id != ? AND e.date >= date('now')
-        """, (user_id,))
+            WHERE e.user_id != ?
+        """ + where, [user_id] + params, ['date', 'event_id'], descending=False)
 
-    other_events = cur.fetchall()
-    return render_template('events/view_events.html', events=other_events)
+    preload_image_variants(row[4] for row in page.rows)
+    return render_template('events/view_events.html', events=page.rows, page=page, filters=filters,
+                           categories=category_counts(con, 'event', user_id, today))
 
 # Attend Event Page
 @app.route('/attend-event/<int:event_id>', methods=['POST'])
@@ -954,6 +894,7 @@ def edit_event(event_id):
             (title, description, category, event_date, event_id, user_id)
         )
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
         flash("Event updated successfully!")
         return redirect(url_for('my_events'))
 
@@ -973,8 +914,12 @@ def confirm_delete_event(event_id):
     
     if request.method == 'POST':
         # Delete the event from the database
+        image = con.execute("SELECT images FROM Events WHERE event_id = ? AND user_id = ?", (event_id, user_id)).fetchone()
         con.execute("DELETE FROM Events WHERE event_id = ? AND user_id = ?", (event_id, user_id))
+        if image:
+            release_image(con, image[0])
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
         flash("Event deleted successfully!")
         return redirect(url_for('my_events'))
     
@@ -1004,6 +949,7 @@ def events_attending():
         WHERE ea.user_id = ?
     """, (user_id,))
     attending_events = cur.fetchall()
+    preload_image_variants(row[3] for row in attending_events)
 
     return render_template('events/events_attending.html', events=attending_events)
 
@@ -1018,14 +964,8 @@ def new_event():
         event_date = request.form.get('date')  # Get event date
 
         # Handle image upload
-        image = request.files['image']
-        if image and allowed_file(image.filename):
-            filename = secure_filename(image.filename)
-            # Ensure upload folder exists
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename).replace("\\", "/")
-            image.save(image_path)
-        else:
+        image_path = save_image(request.files['image'])
+        if image_path is None:
             flash("Invalid image file. Please upload a PNG, JPG, JPEG, or GIF file.")
             return redirect(url_for('new_event'))
 
@@ -1036,6 +976,7 @@ def new_event():
             (user_id, title, description, image_path, category, event_date)
         )
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
 
         flash("Event added successfully!")
         return redirect(url_for('my_events'))
@@ -1049,6 +990,7 @@ def my_events():
     con = get_db()
     cur = con.execute("SELECT event_id, user_id, title, description, images, category, date FROM Events WHERE user_id = ?", (user_id,))
     events = cur.fetchall()
+    preload_image_variants(row[4] for row in events)
     return render_template('events/my_events.html', events=events)
 
 #----------------------------------------------------------------------------------------------------------------------------------
@@ -1089,7 +1031,9 @@ def add_user_review():
             "INSERT INTO Reviews (user_id, reviewer_id, rating, comment, timestamp) VALUES (?, ?, ?, ?, ?)",
             (reviewed_user_id, user_id, rating, comment, timestamp)
         )
+        record_review(con, 'user', reviewed_user_id, rating)
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
 
         flash("User review submitted successfully!")
         return redirect(url_for('reviews_home'))
@@ -1134,6 +1078,7 @@ def add_resource_review():
             "INSERT INTO ResourceReviews (resource_id, reviewer_id, rating, comment, timestamp) VALUES (?, ?, ?, ?, ?)",
             (resource_id, user_id, rating, comment, timestamp)
         )
+        record_review(con, 'resource', resource_id, rating)
         con.commit()
 
         flash("Resource review submitted successfully!")
@@ -1180,6 +1125,7 @@ def add_space_review():
             "INSERT INTO SpaceReviews (space_id, reviewer_id, rating, comment, timestamp) VALUES (?, ?, ?, ?, ?)",
             (space_id, user_id, rating, comment, timestamp)
         )
+        record_review(con, 'space', space_id, rating)
         con.commit()
 
         flash("Space review submitted successfully!")
@@ -1214,34 +1160,51 @@ def view_all_reviews():
     con = get_db()
     search_query = request.args.get('query', '')  # Get the search query from the URL parameters
 
-    # Fetch user reviews with search filter
-    user_reviews = con.execute("""
-        SELECT 'User Review' AS type, u.name AS item_name, r.rating, r.comment, r.timestamp
-        FROM Reviews r
-        JOIN Users u ON r.user_id = u.user_id
-        WHERE u.name LIKE ? OR r.comment LIKE ?
-    """, (f'%{search_query}%', f'%{search_query}%')).fetchall()
-
-    # Fetch resource reviews with search filter
-    resource_reviews = con.execute("""
-        SELECT 'Resource Review' AS type, res.title AS item_name, rr.rating, rr.comment, rr.timestamp
-        FROM ResourceReviews rr
-        JOIN Resources res ON rr.resource_id = res.resource_id
-        WHERE res.title LIKE ? OR rr.comment LIKE ?
-    """, (f'%{search_query}%', f'%{search_query}%')).fetchall()
-
-    # Fetch space reviews with search filter
-    space_reviews = con.execute("""
-        SELECT 'Space Review' AS type, s.title AS item_name, sr.rating, sr.comment, sr.timestamp
-        FROM SpaceReviews sr
-        JOIN Spaces s ON sr.space_id = s.space_id
-        WHERE s.title LIKE ? OR sr.comment LIKE ?
-    """, (f'%{search_query}%', f'%{search_query}%')).fetchall()
-
-    # Combine all reviews into one list
-    all_reviews = user_reviews + resource_reviews + space_reviews
+    search_match = match_expression(search_query)  # Full-text query for the search box
 
-    return render_template('reviews/view_all_reviews.html', all_reviews=all_reviews, search_query=search_query)
+    if search_match:
+        # Search query - full-text match on the reviewed user/resource/space name and the comment,
+        # best matches first across all three kinds of review
+        page = paginate(con, """
+            SELECT 'User Review' AS type, u.name AS item_name, r.rating, r.comment, r.timestamp,
+                   r.review_id AS review_id, ReviewsFTS.rank AS rank
+            FROM ReviewsFTS
+            JOIN Reviews r ON r.review_id = ReviewsFTS.rowid
+            JOIN Users u ON r.user_id = u.user_id
+            WHERE ReviewsFTS MATCH ?
+            UNION ALL
+            SELECT 'Resource Review' AS type, res.title AS item_name, rr.rating, rr.comment, rr.timestamp,
+                   rr.review_id AS review_id, ResourceReviewsFTS.rank AS rank
+            FROM ResourceReviewsFTS
+            JOIN ResourceReviews rr ON rr.review_id = ResourceReviewsFTS.rowid
+            JOIN Resources res ON rr.resource_id = res.resource_id
+            WHERE ResourceReviewsFTS MATCH ?
+            UNION ALL
+            SELECT 'Space Review' AS type, s.title AS item_name, sr.rating, sr.comment, sr.timestamp,
+                   sr.review_id AS review_id, SpaceReviewsFTS.rank AS rank
+            FROM SpaceReviewsFTS
+            JOIN SpaceReviews sr ON sr.review_id = SpaceReviewsFTS.rowid
+            JOIN Spaces s ON sr.space_id = s.space_id
+            WHERE SpaceReviewsFTS MATCH ?
+        """, (search_match, search_match, search_match), ['rank', 'type', 'review_id'],
+            descending=False, hidden=['review_id', 'rank'])
+    else:
+        # No search query - show every review, newest first
+        page = paginate(con, """
+            SELECT 'User Review' AS type, u.name AS item_name, r.rating, r.comment, r.timestamp, r.review_id AS review_id
+            FROM Reviews r
+            JOIN Users u ON r.user_id = u.user_id
+            UNION ALL
+            SELECT 'Resource Review' AS type, res.title AS item_name, rr.rating, rr.comment, rr.timestamp, rr.review_id AS review_id
+            FROM ResourceReviews rr
+            JOIN Resources res ON rr.resource_id = res.resource_id
+            UNION ALL
+            SELECT 'Space Review' AS type, s.title AS item_name, sr.rating, sr.comment, sr.timestamp, sr.review_id AS review_id
+            FROM SpaceReviews sr
+            JOIN Spaces s ON sr.space_id = s.space_id
+        """, (), ['timestamp', 'type', 'review_id'], hidden=['review_id'])
+
+    return render_template('reviews/view_all_reviews.html', all_reviews=page.rows, page=page, search_query=search_query)
 
 #----------------------------------------------------------------------------------------------------------------------------------
 """
@@ -1280,17 +1243,16 @@ def edit_profile():
         location = request.form.get('location')
         
         # Handle profile image upload
-        profile_image = request.files['profile_image']
-        if profile_image and allowed_file(profile_image.filename):
-            filename = secure_filename(profile_image.filename)
-            # Ensure upload folder exists
-            os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-            profile_image_path = os.path.join(app.config['UPLOAD_FOLDER'], filename).replace("\\", "/")
-            profile_image.save(profile_image_path)
-        else:
+        cur = con.execute("SELECT profile_image FROM Users WHERE user_id = ?", (user_id,))
+        old_profile_image_path = cur.fetchone()[0]
+        profile_image_path = save_image(request.files['profile_image'])
+        if profile_image_path is None:
             # If no new image is uploaded, retain the existing path
-            cur = con.execute("SELECT profile_image FROM Users WHERE user_id = ?", (user_id,))
-            profile_image_path = cur.fetchone()[0]
+            profile_image_path = old_profile_image_path
+        else:
+            # save_image counted a reference to the upload, even when it is the
+            # current photo again, so the old photo's reference always goes
+            release_image(con, old_profile_image_path)
 
         # Update user information in the database
         con.execute(
@@ -1298,6 +1260,7 @@ def edit_profile():
             (name, email, location, profile_image_path, user_id)
         )
         con.commit()
+        homepage_cache.invalidate()  # Homepage blocks may show this change
 
         flash("Profile updated successfully!")
         return redirect(url_for('profile'))
@@ -1330,21 +1293,15 @@ def inbox():
     user_id = get_user_id()
     con = get_db()
 
-    # Select unique pairs of users where the current user is involved, along with the other user's name
-    cur = con.execute("""
-        SELECT DISTINCT
-            CASE WHEN sender_id = ? THEN receiver_id ELSE sender_id END AS other_user_id,
-            u.name AS other_user_name,
-            MAX(timestamp) AS last_message_time
-        FROM Messages
-        JOIN Users u ON u.user_id = CASE WHEN sender_id = ? THEN receiver_id ELSE sender_id END
-        WHERE sender_id = ? OR receiver_id = ?
-        GROUP BY other_user_id
-        ORDER BY last_message_time DESC
-    """, (user_id, user_id, user_id, user_id))
-
-    conversations = cur.fetchall()
-    return render_template('messages/inbox.html', conversations=conversations)
+    # Read the user's conversation summaries, with the other user's name, most recent conversation first
+    page = paginate(con, """
+        SELECT c.other_user_id, u.name AS other_user_name, c.last_message_time, c.preview, c.unread_count
+        FROM Conversations c
+        JOIN Users u ON u.user_id = c.other_user_id
+        WHERE c.user_id = ?
+    """, (user_id,), ['last_message_time', 'other_user_id'])
+
+    return render_template('messages/inbox.html', conversations=page.rows, page=page)
 
 # Conversation
 @app.route('/conversation/<int:other_user_id>', methods=['GET', 'POST'])
@@ -1356,29 +1313,215 @@ def conversation(other_user_id):
         content = request.form.get('message')
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        # Insert the new message
-        con.execute("""
-            INSERT INTO Messages (sender_id, receiver_id, content, timestamp) 
-            VALUES (?, ?, ?, ?)
-        """, (user_id, other_user_id, content, timestamp))
-        
+        # Insert the new message and update both users' conversation summaries
+        message_id = send_message(con, user_id, other_user_id, content, timestamp)
         con.commit()
+        message_broker.publish(user_id, other_user_id)
+
+        # The live conversation page posts in the background and gets the message back over its stream
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(message_id=message_id), 201
         return redirect(url_for('conversation', other_user_id=other_user_id))
     
-    # Fetch all messages between the current user and the other user
-    cur = con.execute("""
-        SELECT sender_id, content, timestamp 
-        FROM Messages 
-        WHERE (sender_id = ? AND receiver_id = ?) OR (sender_id = ? AND receiver_id = ?)
-        ORDER BY timestamp
-    """, (user_id, other_user_id, other_user_id, user_id))
-    
-    messages = cur.fetchall()
+    # Fetch one page of messages between the current user and the other user, newest first.
+    # Each direction of the thread is read from its own (sender_id, receiver_id, message_id)
+    # index range, so only about two pages of rows are touched however long the thread is.
+    # Both statements are written out in full so check_query_plans.py checks them.
+    page_request = PageRequest(1)
+    if page_request.forward:
+        # Older messages
+        sql = """
+            SELECT * FROM (
+                SELECT sender_id, content, timestamp, message_id
+                FROM Messages
+                WHERE sender_id = ? AND receiver_id = ? AND message_id < ?
+                ORDER BY message_id DESC LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT sender_id, content, timestamp, message_id
+                FROM Messages
+                WHERE sender_id = ? AND receiver_id = ? AND message_id < ?
+                ORDER BY message_id DESC LIMIT ?
+            )
+            ORDER BY message_id DESC
+            LIMIT ?
+        """
+    else:
+        # Newer messages
+        sql = """
+            SELECT * FROM (
+                SELECT sender_id, content, timestamp, message_id
+                FROM Messages
+                WHERE sender_id = ? AND receiver_id = ? AND message_id > ?
+                ORDER BY message_id ASC LIMIT ?
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT sender_id, content, timestamp, message_id
+                FROM Messages
+                WHERE sender_id = ? AND receiver_id = ? AND message_id > ?
+                ORDER BY message_id ASC LIMIT ?
+            )
+            ORDER BY message_id ASC
+            LIMIT ?
+        """
+    cursor = page_request.cursor[0] if page_request.cursor else (None if page_request.forward else 0)
+    if cursor is None:
+        cursor = 2 ** 63 - 1
+    rows = con.execute(sql, (user_id, other_user_id, cursor, page_request.size + 1,
+                             other_user_id, user_id, cursor, page_request.size + 1,
+                             page_request.size + 1)).fetchall()
+    page = page_request.page(rows, lambda row: [row[3]])
+
+    # Show the page oldest-to-newest, like a chat
+    messages = page.rows[::-1]
+
+    # Viewing the newest messages marks the conversation as read
+    if page_request.cursor is None and mark_read(con, user_id, other_user_id):
+        con.commit()
 
     # Fetch the other user's name for display in the conversation header
     other_user_name = con.execute("SELECT name FROM Users WHERE user_id = ?", (other_user_id,)).fetchone()[0]
 
-    return render_template('messages/conversation.html', messages=messages, other_user_id=other_user_id, other_user_name=other_user_name, user_id=user_id)
+    return render_template('messages/conversation.html', messages=messages, page=page, other_user_id=other_user_id, other_user_name=other_user_name, user_id=user_id)
+
+# Messages in a conversation newer than the given message id, oldest first, as
+# JSON-ready dicts. Delivering them marks the conversation as read.
+def thread_messages(con, user_id, other_user_id, after, limit=100):
+    rows = con.execute("""
+        SELECT * FROM (
+            SELECT sender_id, content, timestamp, message_id
+            FROM Messages
+            WHERE sender_id = ? AND receiver_id = ? AND message_id > ?
+            ORDER BY message_id LIMIT ?
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT sender_id, content, timestamp, message_id
+            FROM Messages
+            WHERE sender_id = ? AND receiver_id = ? AND message_id > ?
+            ORDER BY message_id LIMIT ?
+        )
+        ORDER BY message_id
+        LIMIT ?
+    """, (user_id, other_user_id, after, limit, other_user_id, user_id, after, limit, limit)).fetchall()
+    if rows and mark_read(con, user_id, other_user_id):
+        con.commit()
+    return [
+        {'message_id': message_id, 'sender_id': sender_id, 'content': content,
+         'timestamp': timestamp, 'sent': sender_id == user_id}
+        for sender_id, content, timestamp, message_id in rows
+    ]
+
+# Streams and long polls outlive the request context, so they borrow a pooled
+# connection only for the moment they read
+def messages_after(user_id, other_user_id, after):
+    with get_db_pool().connection() as con:
+        return thread_messages(con, user_id, other_user_id, after)
+
+# Position the client has already seen: the EventSource reconnect header, or ?after=
+def stream_cursor():
+    try:
+        return int(request.headers.get('Last-Event-ID') or request.args.get('after', 0))
+    except ValueError:
+        return 0
+
+# Answer for a stream or long poll when the worker has no live-update slot free
+def live_updates_busy():
+    response = make_response(jsonify(error="Too many live connections; poll the messages URL instead"), 503)
+    response.headers['Retry-After'] = str(LIVE_UPDATES_RETRY_AFTER)
+    return response
+
+# Live conversation updates over Server-Sent Events. Only messages newer than the
+# client's cursor are sent, and the connection stays open for the next ones until
+# STREAM_LIFETIME; the browser then reconnects with Last-Event-ID.
+@app.route('/conversation/<int:other_user_id>/stream')
+def conversation_stream(other_user_id):
+    user_id = get_user_id()
+    after = stream_cursor()
+    if not live_update_slots.acquire(blocking=False):
+        return live_updates_busy()
+    # Subscribe before the first read so nothing sent in between is missed
+    subscription = message_broker.subscribe(user_id)
+
+    def events():
+        cursor = after
+        deadline = time.monotonic() + STREAM_LIFETIME
+        yield "retry: 3000\n\n"
+        while True:
+            for message in messages_after(user_id, other_user_id, cursor):
+                cursor = message['message_id']
+                yield f"id: {cursor}\ndata: {json.dumps(message)}\n\n"
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            if not subscription.wait(min(STREAM_KEEPALIVE, remaining)):
+                yield ": keepalive\n\n"
+
+    response = Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # don't let a proxy buffer the stream
+    })
+
+    # Runs when the server is done with the response, even if the stream never started
+    @response.call_on_close
+    def release():
+        message_broker.unsubscribe(subscription)
+        live_update_slots.release()
+
+    return response
+
+# Long-poll fallback for clients without EventSource: answers as soon as there are
+# messages newer than ?after=, or with an empty list after LONG_POLL_TIMEOUT
+@app.route('/conversation/<int:other_user_id>/poll')
+def conversation_poll(other_user_id):
+    user_id = get_user_id()
+    after = stream_cursor()
+    if not live_update_slots.acquire(blocking=False):
+        return live_updates_busy()
+    subscription = message_broker.subscribe(user_id)
+    try:
+        deadline = time.monotonic() + LONG_POLL_TIMEOUT
+        while True:
+            messages = messages_after(user_id, other_user_id, after)
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0:
+                return jsonify(messages)
+            subscription.wait(remaining)
+    finally:
+        message_broker.unsubscribe(subscription)
+        live_update_slots.release()
+
+# Messages newer than ?after= as JSON, for clients that poll. The ETag names the
+# newest message in the thread, found with one probe per direction of the
+# (sender_id, receiver_id, message_id) index, so an idle poll is answered with a
+# 304 without reading any messages.
+@app.route('/conversation/<int:other_user_id>/messages')
+def conversation_messages(other_user_id):
+    user_id = get_user_id()
+    after = stream_cursor()
+    try:
+        limit = max(1, min(int(request.args.get('limit', 100)), 100))
+    except ValueError:
+        limit = 100
+
+    con = get_db()
+    latest = con.execute("""
+        SELECT MAX(message_id) FROM (
+            SELECT MAX(message_id) AS message_id FROM Messages WHERE sender_id = ? AND receiver_id = ?
+            UNION ALL
+            SELECT MAX(message_id) FROM Messages WHERE sender_id = ? AND receiver_id = ?
+        )
+    """, (user_id, other_user_id, other_user_id, user_id)).fetchone()[0] or 0
+    etag = f"{latest}-{after}-{limit}"
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = jsonify(thread_messages(con, user_id, other_user_id, after, limit))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 # New message 
 @app.route('/new-message')
@@ -1388,7 +1531,6 @@ def new_message():
     
     # Fetch list of all users except the current user
     users = con.execute("SELECT user_id, name FROM Users WHERE user_id != ?", (user_id,)).fetchall()
-    print("Users fetched:", users)  # Debugging line
     return render_template('messages/new_message.html', users=users)
 
 # Send a new message
@@ -1400,12 +1542,10 @@ def send_new_message():
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
     con = get_db()
-    # Insert the new message into the Messages table
-    con.execute("""
-        INSERT INTO Messages (sender_id, receiver_id, content, timestamp)
-        VALUES (?, ?, ?, ?)
-    """, (sender_id, receiver_id, message_content, timestamp))
+    # Insert the new message and update both users' conversation summaries
+    send_message(con, sender_id, receiver_id, message_content, timestamp)
     con.commit()
+    message_broker.publish(sender_id, receiver_id)
 
     flash("Message sent successfully.")
     return redirect(url_for('inbox'))
@@ -1419,6 +1559,71 @@ def logout():
     flash("You have been logged out.")
     return redirect(url_for('main'))
 
-# Run the app
+#----------------------------------------------------------------------------------------------------------------------------------
+
+"""
+Health Checks and Metrics
+"""
+
+# Liveness: the process is up and serving requests. Deliberately touches nothing
+# else, so a busy database never gets a healthy worker restarted.
+@app.route('/healthz')
+def healthz():
+    return jsonify(status="ok")
+
+# Readiness: this worker can serve real traffic - it can get a connection from
+# its pool, the database answers and the schema is fully migrated
+@app.route('/readyz')
+def readyz():
+    try:
+        con = get_db()
+        con.execute("SELECT 1").fetchone()
+        pending = pending_migrations(con)
+        version = current_version(con)
+    except Exception as e:
+        app.logger.warning("Readiness check failed: %s", e)
+        return jsonify(status="unavailable", error=str(e)), 503
+    status = "ok" if not pending else "migrating"
+    body = jsonify(status=status, schema_version=version, pid=os.getpid(),
+                   pool=get_db_pool().stats())
+    return body, 200 if not pending else 503
+
+# Prometheus scrape endpoint. Under gunicorn it reports all workers together.
+@app.route('/metrics')
+def metrics_endpoint():
+    with get_db_pool().connection() as con:
+        metrics.observe_jobs(queue_stats(con))
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+#----------------------------------------------------------------------------------------------------------------------------------
+
+# Configure the app for serving and return it; wsgi.py calls this for gunicorn.
+# Routes are registered on the module-level app at import, so this applies the
+# settings that depend on where it runs: `config` overrides, and with
+# APP_ENV=production the shared template bytecode cache (compiled once, loaded
+# at boot, never re-read from disk).
+def create_app(config=None):
+    if config:
+        app.config.update(config)
+    # Under gunicorn, log through its handlers at its level, so the per-request
+    # lines (querylog.py) land in the server's log
+    gunicorn_logger = logging.getLogger('gunicorn.error')
+    if gunicorn_logger.handlers:
+        app.logger.handlers = gunicorn_logger.handlers
+        app.logger.setLevel(gunicorn_logger.level)
+    if app.config['APP_ENV'] == 'production' and not app.config.get('TEMPLATES_PRELOADED'):
+        if app.secret_key == 'your_secret_key':
+            app.logger.warning("SECRET_KEY is not set; sessions are signed with the development key")
+        app.logger.info("Preloaded %s templates", configure_production(app))
+        app.config['TEMPLATES_PRELOADED'] = True
+    return app
+
+# Run the development server. In production the app is served by gunicorn
+# (gunicorn -c gunicorn.conf.py wsgi:app), where each worker starts a job thread
+# after forking unless RUN_JOB_WORKER=0 (then jobs run by `python jobs.py work`).
 if __name__ == '__main__':
-    app.run(debug=True)
+    # The development server runs the job worker in-process
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_worker_thread(DATABASE)
+    create_app().run(debug=True)
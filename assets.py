@@ -0,0 +1,222 @@
+import glob
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+
+import brotli
+from flask import abort, request, send_file, url_for
+from werkzeug.security import safe_join
+
+from blobstore import IMMUTABLE_CACHE_CONTROL
+
+STATIC_FOLDER = 'static'
+# Build output: fingerprinted files, their .gz/.br twins and the manifest
+DIST_FOLDER = 'static/dist'
+MANIFEST = os.path.join(DIST_FOLDER, 'manifest.json')
+
+# Built asset -> source files (under static/) concatenated into it. Each page
+# loads a single stylesheet: base.html uses style.css, login_base.html styles.css.
+BUNDLES = {
+    'css/style.css': ['css/style.css'],
+    'css/styles.css': ['css/styles.css'],
+    'js/conversation.js': ['js/conversation.js'],
+}
+
+# Files searched for class names and ids when deciding whether a CSS rule is dead
+MARKUP_SOURCES = ['templates/**/*.html', 'static/js/**/*.js']
+
+COMMENT = re.compile(r'/\*.*?\*/', re.S)
+STRING = re.compile(r'"(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'')
+SELECTOR_NAME = re.compile(r'[.#](-?[_a-zA-Z][\w-]*)')
+WORD = re.compile(r'[\w-]+')
+
+
+# Collapse whitespace outside strings and drop it around the given punctuation
+def _squeeze(text, punctuation):
+    parts = []
+    last = 0
+    for match in STRING.finditer(text):
+        parts.append(_squeeze_plain(text[last:match.start()], punctuation))
+        parts.append(match.group())
+        last = match.end()
+    parts.append(_squeeze_plain(text[last:], punctuation))
+    return ''.join(parts).strip()
+
+
+def _squeeze_plain(text, punctuation):
+    text = re.sub(r'\s+', ' ', text)
+    return re.sub(r'\s*([' + re.escape(punctuation) + r'])\s*', r'\1', text)
+
+
+def _skip_string(css, pos):
+    match = STRING.match(css, pos)
+    return match.end() if match else pos + 1
+
+
+# Parse a stylesheet into (prelude, body) nodes. body is the declaration text of
+# a rule, a list of nodes for a grouping at-rule (@media, @supports), or None for
+# a statement such as @import.
+def parse(css, pos=0):
+    nodes = []
+    start = pos
+    while pos < len(css):
+        char = css[pos]
+        if char in '"\'':
+            pos = _skip_string(css, pos)
+        elif char == '{':
+            prelude = css[start:pos].strip()
+            if prelude.startswith(('@media', '@supports')):
+                children, pos = parse(css, pos + 1)
+                nodes.append((prelude, children))
+            else:
+                end = pos + 1
+                while css[end] != '}':
+                    end = _skip_string(css, end) if css[end] in '"\'' else end + 1
+                nodes.append((prelude, css[pos + 1:end]))
+                pos = end + 1
+            start = pos
+        elif char == '}':
+            return nodes, pos + 1
+        elif char == ';' and css[start:pos].strip().startswith('@'):
+            nodes.append((css[start:pos].strip(), None))
+            pos += 1
+            start = pos
+        else:
+            pos += 1
+    return nodes, pos
+
+
+# Class names and ids that markup or scripts could put on an element. Every
+# word counts, which keeps classes chosen by template expressions alive.
+def used_names():
+    names = set()
+    for pattern in MARKUP_SOURCES:
+        for path in glob.glob(pattern, recursive=True):
+            with open(path, encoding='utf-8') as f:
+                names.update(WORD.findall(f.read()))
+    return names
+
+
+def _selector_used(selector, names):
+    # Attribute selectors and strings can contain dots that are not class names
+    selector = re.sub(r'\[[^\]]*\]', '', STRING.sub('', selector))
+    return all(name in names for name in SELECTOR_NAME.findall(selector))
+
+
+# Minified CSS for the given nodes, without rules that no markup can match.
+# Returns the CSS and the number of selectors removed.
+def render(nodes, names):
+    output = []
+    removed = 0
+    for prelude, body in nodes:
+        if body is None:
+            output.append(_squeeze(prelude, ',') + ';')
+        elif isinstance(body, list):
+            inner, inner_removed = render(body, names)
+            removed += inner_removed
+            if inner:
+                output.append(_squeeze(prelude, ':,') + '{' + inner + '}')
+        else:
+            selectors = [_squeeze(s, '>,') for s in prelude.split(',')]
+            live = [s for s in selectors if _selector_used(s, names)]
+            removed += len(selectors) - len(live)
+            declarations = _squeeze(body, ':;,').strip(';')
+            if live and declarations:
+                output.append(','.join(live) + '{' + declarations + '}')
+    return ''.join(output), removed
+
+
+def minify_css(css, names):
+    nodes, _ = parse(COMMENT.sub('', css))
+    return render(nodes, names)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+# Build every bundle into DIST_FOLDER under a name that includes a hash of its
+# content, with gzip and brotli copies for clients that accept them, and write
+# the manifest that asset_url() reads. Returns the manifest.
+def build(verbose=False):
+    names = used_names()
+    manifest = {}
+    for name, sources in BUNDLES.items():
+        text = ''
+        for source in sources:
+            with open(os.path.join(STATIC_FOLDER, source), encoding='utf-8') as f:
+                text += f.read() + '\n'
+        removed = 0
+        if name.endswith('.css'):
+            text, removed = minify_css(text, names)
+        data = text.encode('utf-8')
+
+        stem, extension = os.path.splitext(name)
+        built = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}"
+        path = os.path.join(DIST_FOLDER, built)
+        _write(path, data)
+        _write(path + '.gz', gzip.compress(data, 9, mtime=0))
+        _write(path + '.br', brotli.compress(data))
+        manifest[name] = built
+        if verbose:
+            print(f"{name} -> {built}: {len(data)} bytes, {len(gzip.compress(data, 9))} gzip, "
+                  f"{len(brotli.compress(data))} brotli, {removed} unused selectors removed")
+
+    _write(MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+_manifest = None
+
+
+def load_manifest():
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST) as f:
+                _manifest = json.load(f)
+        except FileNotFoundError:
+            _manifest = {}
+    return _manifest
+
+
+# URL of an asset by its source name: the fingerprinted build when one exists,
+# otherwise the source file itself (development without a build)
+def asset_url(name):
+    built = load_manifest().get(name)
+    if built is None:
+        return url_for('static', filename=name)
+    return url_for('asset', filename=built)
+
+
+# Response for a built asset, precompressed when the client accepts it. Built
+# names change with their content, so they can be cached for a year.
+def send_asset(filename):
+    path = safe_join(DIST_FOLDER, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+            response = send_file(path + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_file(path, mimetype=mimetype)
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+# python assets.py build
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'build':
+        print("usage: python assets.py build")
+        sys.exit(2)
+    build(verbose=True)
@@ -0,0 +1,57 @@
+import sqlite3
+import sys
+import threading
+from datetime import datetime
+
+from listings import KINDS
+from migrations import DATABASE
+
+# Day the projection was last rolled over to, as seen by this process
+_current_day = None
+_lock = threading.Lock()
+
+
+def today():
+    return datetime.now().date().strftime('%Y-%m-%d')
+
+
+# Recompute is_reserved for every item as of the given day. Reservations start and
+# end at day boundaries, so this only needs to run once per day.
+def rollover(con, day=None):
+    day = day or today()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        # Another worker may have rolled over while we waited for the lock
+        row = con.execute("SELECT day FROM AvailabilityRollover").fetchone()
+        if row is None or row[0] != day:
+            for kind in KINDS.values():
+                con.execute(kind.refresh_all_sql, (day, day))
+            con.execute("DELETE FROM AvailabilityRollover")
+            con.execute("INSERT INTO AvailabilityRollover (day) VALUES (?)", (day,))
+    except Exception:
+        con.rollback()
+        raise
+    con.commit()
+
+
+# Make sure is_reserved reflects today before a listing reads it. After the first
+# call of the day this is a comparison against a cached date.
+def ensure_current(con):
+    global _current_day
+    day = today()
+    if _current_day == day:
+        return
+    with _lock:
+        if _current_day != day:
+            row = con.execute("SELECT day FROM AvailabilityRollover").fetchone()
+            if row is None or row[0] != day:
+                rollover(con, day)
+            _current_day = day
+
+
+# Daily rollover job, e.g. from cron shortly after midnight
+if __name__ == '__main__':
+    connection = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else DATABASE)
+    rollover(connection)
+    connection.close()
+    print(f"Availability rolled over to {today()}.")
@@ -0,0 +1 @@
+# Benchmarks: python -m bench.seed, then python -m bench.run
@@ -0,0 +1,219 @@
+import argparse
+import http.cookiejar
+import json
+import math
+import os
+import sqlite3
+import sys
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench.seed import BENCH_DATABASE, PASSWORD
+
+# Stored results that later runs are compared with
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+# A route is a regression when its p95 grows by more than this fraction (and by
+# more than MIN_REGRESSION_MS, which is timer noise for the fastest routes), or
+# it runs more queries per request than in the baseline
+REGRESSION_THRESHOLD = 0.20
+MIN_REGRESSION_MS = 1.0
+
+# Benchmarked routes: name -> path. {user}, {contact}, {resource} and {space} are
+# filled in from the seeded data (see targets()).
+ROUTES = {
+    'homepage': '/homepage',
+    'dashboard': '/dashboard',
+    'view_resources': '/view-resources',
+    'view_resources_search': '/view-resources?query=garden+drill',
+    'view_spaces': '/view-spaces',
+    'view_events': '/view-events',
+    'inbox': '/inbox',
+    'conversation': '/conversation/{contact}',
+    'reserve_resource': '/reserve-resource/{resource}',
+    'reserve_space': '/reserve-space/{space}',
+    'view_all_reviews': '/view-all-reviews',
+    'my_resources': '/my-resources',
+    'profile': '/profile',
+}
+# Statements counted as queries (not transaction control or pragmas)
+QUERY_KEYWORDS = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+
+
+# Ids that make the parameterized routes hit rows with realistic amounts of
+# data: the seeded data is skewed towards low ids, so user 1 is the busiest user
+def targets(database, user_id):
+    con = sqlite3.connect(database)
+    try:
+        contact = con.execute(
+            "SELECT other_user_id FROM Conversations WHERE user_id = ? ORDER BY last_message_time DESC LIMIT 1", (user_id,)
+        ).fetchone()
+        resource = con.execute("SELECT MIN(resource_id) FROM Resources WHERE user_id != ?", (user_id,)).fetchone()
+        space = con.execute("SELECT MIN(space_id) FROM Spaces WHERE user_id != ?", (user_id,)).fetchone()
+    finally:
+        con.close()
+    return {
+        'user': user_id,
+        'contact': contact[0] if contact else user_id,
+        'resource': resource[0] or 1,
+        'space': space[0] or 1,
+    }
+
+
+# Nearest-rank percentile
+def percentile(sorted_values, fraction):
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def summarize(timings, queries):
+    timings = sorted(timings)
+    return {
+        "requests": len(timings),
+        "p50_ms": percentile(timings, 0.50),
+        "p95_ms": percentile(timings, 0.95),
+        "p99_ms": percentile(timings, 0.99),
+        "mean_ms": sum(timings) / len(timings),
+        "queries": max(queries) if queries else None,
+    }
+
+
+# Drives the app in this process through Flask's test client, counting the SQL
+# statements each request runs on its pooled connection
+class InProcessClient:
+    def __init__(self, user_id):
+        from app import create_app, get_db
+        self.app = create_app({'TESTING': True})
+        self.queries = 0
+        self.app.before_request(lambda: get_db().set_trace_callback(self._trace))
+        self.app.teardown_request(lambda exception: get_db().set_trace_callback(None))
+        self.client = self.app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = user_id
+
+    def _trace(self, statement):
+        if statement.lstrip().upper().startswith(QUERY_KEYWORDS):
+            self.queries += 1
+
+    def get(self, path):
+        self.queries = 0
+        start = time.perf_counter()
+        response = self.client.get(path)
+        response.get_data()
+        elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code != 200:
+            raise RuntimeError(f"GET {path} returned {response.status_code}")
+        return elapsed, self.queries
+
+
+# Drives a running server (e.g. gunicorn) over HTTP, logged in as the user.
+# Query counts are not visible from outside, so none are reported.
+class HttpClient:
+    def __init__(self, base_url, user_id):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        form = urllib.parse.urlencode({'email': f"user{user_id}@example.com", 'password': PASSWORD}).encode()
+        self.opener.open(self.base_url + '/process-login', form).read()
+
+    def get(self, path):
+        start = time.perf_counter()
+        with self.opener.open(self.base_url + path) as response:
+            response.read()
+        return (time.perf_counter() - start) * 1000, None
+
+
+def measure(client, path, requests, warmup, concurrency):
+    for _ in range(warmup):
+        client.get(path)
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(lambda _: client.get(path), range(requests)))
+    else:
+        results = [client.get(path) for _ in range(requests)]
+    return summarize([ms for ms, _ in results], [q for _, q in results if q is not None])
+
+
+# Per-route changes against the baseline, and the names of the routes that regressed
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    changes = {}
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        more_queries = (result['queries'] is not None and before.get('queries') is not None
+                        and result['queries'] > before['queries'])
+        changes[name] = change
+        slower = change > threshold and result['p95_ms'] - before['p95_ms'] > MIN_REGRESSION_MS
+        if slower or more_queries:
+            regressions.append(name)
+    return changes, regressions
+
+
+def report(results, changes, regressions):
+    print(f"{'route':<24}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}{'p95 vs baseline':>17}")
+    for name, result in results.items():
+        queries = '-' if result['queries'] is None else result['queries']
+        change = f"{changes[name]:+.0%}" if name in changes else ''
+        flag = '  REGRESSION' if name in regressions else ''
+        print(f"{name:<24}{result['p50_ms']:>9.1f}{result['p95_ms']:>9.1f}{result['p99_ms']:>9.1f}{queries:>9}{change:>17}{flag}")
+
+
+# python -m bench.run [--url URL] [--routes a,b] [--save-baseline] ...
+# Without --url the app runs in-process against DATABASE (default bench/bench.db,
+# created with python -m bench.seed). Exits with status 1 if a route regressed.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the app's routes")
+    parser.add_argument('--db', default=os.environ.get('DATABASE', BENCH_DATABASE))
+    parser.add_argument('--url', help="benchmark a running server instead of the app in-process")
+    parser.add_argument('--user', type=int, default=1, help="seeded user to log in as")
+    parser.add_argument('--routes', help="comma-separated route names (default: all)")
+    parser.add_argument('--requests', type=int, default=50, help="timed requests per route")
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        parser.error(f"{args.db} does not exist; create it with python -m bench.seed")
+    if args.concurrency > 1 and not args.url:
+        parser.error("--concurrency needs --url: the in-process client runs one request at a time")
+    # app.py reads DATABASE when it is first imported
+    os.environ['DATABASE'] = args.db
+    names = args.routes.split(',') if args.routes else list(ROUTES)
+    ids = targets(args.db, args.user)
+    client = HttpClient(args.url, args.user) if args.url else InProcessClient(args.user)
+
+    results = {}
+    for name in names:
+        results[name] = measure(client, ROUTES[name].format(**ids), args.requests, args.warmup, args.concurrency)
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored['routes']
+        if (stored.get('url'), stored.get('concurrency')) != (args.url, args.concurrency):
+            print(f"Note: the baseline was measured with url={stored.get('url')} and "
+                  f"concurrency={stored.get('concurrency')}; timings are not directly comparable")
+    changes, regressions = compare(results, baseline, args.threshold)
+    report(results, changes, regressions)
+
+    document = {"created": time.strftime('%Y-%m-%d %H:%M:%S'), "database": args.db, "url": args.url,
+                "requests": args.requests, "concurrency": args.concurrency, "routes": results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(document, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(document, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
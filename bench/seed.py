@@ -0,0 +1,204 @@
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import availability
+import ratings
+from messaging import send_message
+from migrations import migrate
+from querylog import InstrumentedConnection
+
+# Default benchmark database, kept apart from the real one
+BENCH_DATABASE = os.path.join(os.path.dirname(__file__), 'bench.db')
+
+# Rows per table at --scale 1. Tens of thousands of users with hundreds of
+# thousands of reservations, messages and reviews between them.
+ROWS = {
+    'users': 20000,
+    'resources': 20000,
+    'spaces': 10000,
+    'events': 10000,
+    'resource_reservations': 200000,
+    'space_reservations': 100000,
+    'event_attendance': 100000,
+    'messages': 300000,
+    'user_reviews': 100000,
+    'resource_reviews': 100000,
+    'space_reviews': 50000,
+}
+# Every seeded user logs in with this password
+PASSWORD = 'benchmark'
+# Each user messages only a few regular contacts, as real users do
+CONTACTS_PER_USER = 8
+# Listings and reservations spread over this many days before and after today
+HISTORY_DAYS = 730
+FUTURE_DAYS = 120
+
+WORDS = (
+    "garden drill ladder bike tent kayak projector table chairs grill mixer camera "
+    "sewing machine hall studio room court yard kitchen garage workshop meeting "
+    "community park music yoga book club cleanup market repair cafe picnic lesson "
+    "vintage electric portable large small wooden outdoor indoor family weekend"
+).split()
+CATEGORIES = ['Tools', 'Sports', 'Electronics', 'Garden', 'Kitchen', 'Music', 'Books', 'Outdoor', 'Party', 'Other']
+AVAILABILITY = ['Available', 'Weekends only', 'Weekdays', 'By arrangement']
+# Listings point at a handful of image paths, as if many users uploaded the same photos
+IMAGES = [f"static/blobs/be/nc/bench{n}.jpg" for n in range(20)]
+
+
+class Seeder:
+    def __init__(self, con, scale, seed):
+        self.con = con
+        self.rows = {table: max(1, int(count * scale)) for table, count in ROWS.items()}
+        self.random = random.Random(seed)
+        self.now = datetime.now().replace(microsecond=0)
+
+    # A user id skewed towards low ids, so a few users are very active (user 1
+    # most of all) and most have little history
+    def user(self):
+        return 1 + int(self.rows['users'] * self.random.random() ** 2)
+
+    def item(self, table):
+        return 1 + int(self.rows[table] * self.random.random() ** 2)
+
+    def words(self, count):
+        return ' '.join(self.random.choice(WORDS) for _ in range(count))
+
+    def moment(self, days_back=HISTORY_DAYS, days_ahead=0):
+        offset = self.random.uniform(-days_back, days_ahead)
+        return self.now + timedelta(days=offset)
+
+    def timestamp(self, **kwargs):
+        return self.moment(**kwargs).strftime('%Y-%m-%d %H:%M:%S')
+
+    def contact(self, user_id):
+        users = self.rows['users']
+        return 1 + (user_id * 7919 + self.random.randrange(CONTACTS_PER_USER) * 104729) % users
+
+    def insert(self, sql, rows):
+        self.con.executemany(sql, rows)
+
+    def users(self):
+        self.insert(
+            "INSERT INTO Users (user_id, name, email, password, profile_image, location) VALUES (?, ?, ?, ?, ?, ?)",
+            ((n, f"User {n} {self.random.choice(WORDS).title()}", f"user{n}@example.com", PASSWORD,
+              self.random.choice(IMAGES), f"Block {n % 200}")
+             for n in range(1, self.rows['users'] + 1))
+        )
+
+    def listings(self, table, count):
+        self.insert(
+            f"INSERT INTO {table} (user_id, title, description, images, category, availability, date_posted) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            ((self.user(), self.words(3).title(), self.words(20), self.random.choice(IMAGES),
+              self.random.choice(CATEGORIES), self.random.choice(AVAILABILITY), self.timestamp())
+             for _ in range(count))
+        )
+
+    def events(self):
+        self.insert(
+            "INSERT INTO Events (user_id, title, description, images, category, date) VALUES (?, ?, ?, ?, ?, ?)",
+            ((self.user(), self.words(3).title(), self.words(20), self.random.choice(IMAGES),
+              self.random.choice(CATEGORIES), self.moment(days_ahead=FUTURE_DAYS).strftime('%Y-%m-%d'))
+             for _ in range(self.rows['events']))
+        )
+
+    def reservations(self, table, item_column, items, count):
+        def rows():
+            for _ in range(count):
+                start = self.moment(days_ahead=FUTURE_DAYS)
+                end = start + timedelta(days=self.random.randint(0, 14))
+                created = start - timedelta(days=self.random.uniform(0, 30))
+                yield (self.item(items), self.user(), start.date().isoformat(), end.date().isoformat(),
+                       min(created, self.now).strftime('%Y-%m-%d %H:%M:%S'))
+        self.insert(
+            f"INSERT INTO {table} ({item_column}, user_id, reservation_start_date, reservation_end_date, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows()
+        )
+
+    def attendance(self):
+        self.insert(
+            "INSERT INTO EventAttendance (event_id, user_id, created_at) VALUES (?, ?, ?)",
+            ((self.item('events'), self.user(), self.timestamp()) for _ in range(self.rows['event_attendance']))
+        )
+
+    # Through messaging.send_message, so the Conversations summaries match
+    def messages(self):
+        sent = sorted(self.timestamp(days_back=HISTORY_DAYS / 4) for _ in range(self.rows['messages']))
+        for timestamp in sent:
+            sender = self.user()
+            send_message(self.con, sender, self.contact(sender), self.words(12), timestamp)
+
+    def reviews(self):
+        self.insert(
+            "INSERT INTO Reviews (user_id, reviewer_id, rating, comment, timestamp) VALUES (?, ?, ?, ?, ?)",
+            ((self.user(), self.user(), self.random.randint(1, 5), self.words(15), self.timestamp())
+             for _ in range(self.rows['user_reviews']))
+        )
+        for table, column, items, count in (
+            ('ResourceReviews', 'resource_id', 'resources', self.rows['resource_reviews']),
+            ('SpaceReviews', 'space_id', 'spaces', self.rows['space_reviews']),
+        ):
+            self.insert(
+                f"INSERT INTO {table} ({column}, reviewer_id, rating, comment, timestamp) VALUES (?, ?, ?, ?, ?)",
+                ((self.item(items), self.user(), self.random.randint(1, 5), self.words(15), self.timestamp())
+                 for _ in range(count))
+            )
+
+    def run(self, verbose=True):
+        steps = [
+            ('users', self.users),
+            ('resources', lambda: self.listings('Resources', self.rows['resources'])),
+            ('spaces', lambda: self.listings('Spaces', self.rows['spaces'])),
+            ('events', self.events),
+            ('resource reservations', lambda: self.reservations(
+                'ResourceReservations', 'resource_id', 'resources', self.rows['resource_reservations'])),
+            ('space reservations', lambda: self.reservations(
+                'SpaceReservations', 'space_id', 'spaces', self.rows['space_reservations'])),
+            ('event attendance', self.attendance),
+            ('messages', self.messages),
+            ('reviews', self.reviews),
+        ]
+        for name, step in steps:
+            start = time.perf_counter()
+            with self.con:
+                step()
+            if verbose:
+                print(f"Seeded {name} in {time.perf_counter() - start:.1f}s")
+        # Derived data the app otherwise maintains request by request
+        ratings.rebuild(self.con)
+        availability.rollover(self.con)
+        self.con.execute("ANALYZE")
+
+
+# Create a fresh, fully migrated database at `path` filled with synthetic data.
+# The same seed and scale always produce the same rows (dates are relative to today).
+def seed(path=BENCH_DATABASE, scale=1.0, random_seed=1, verbose=True):
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    # The connection class the app's pool uses, so seeding writes the way requests do
+    con = sqlite3.connect(path, factory=InstrumentedConnection)
+    con.execute("PRAGMA journal_mode = WAL")
+    try:
+        migrate(con)
+        seeder = Seeder(con, scale, random_seed)
+        seeder.run(verbose)
+        return seeder.rows
+    finally:
+        con.close()
+
+
+# python -m bench.seed [--db PATH] [--scale N] [--seed N]
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create a benchmark database filled with synthetic data")
+    parser.add_argument('--db', default=BENCH_DATABASE)
+    parser.add_argument('--scale', type=float, default=1.0, help="multiplier for the row counts in ROWS")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    rows = seed(args.db, args.scale, args.seed)
+    print(f"Created {args.db} with {sum(rows.values())} rows in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,68 @@
+import os
+
+# Uploaded images are stored once per distinct content, named by the SHA-256 of
+# the uploaded bytes and sharded two levels deep so no directory gets huge:
+# static/blobs/ab/cd/abcd1234....jpg. A name never changes meaning, so blobs and
+# their variants can be cached by browsers forever.
+BLOB_ROOT = 'static/blobs'
+# Uploads waiting for the job worker. Kept out of static/: they are the raw
+# uploads, metadata (EXIF, GPS) included.
+STAGING_FOLDER = os.environ.get('STAGING_FOLDER', 'staging')
+# Cache-Control for anything under BLOB_ROOT
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def blob_folder(digest):
+    return f"{BLOB_ROOT}/{digest[:2]}/{digest[2:4]}"
+
+
+def blob_path(digest, extension):
+    return f"{blob_folder(digest)}/{digest}.{extension}"
+
+
+# Count one more user of a blob. Returns True if the blob is new, in which case
+# the caller has to write it. Runs in the caller's transaction.
+def add_reference(con, digest, path):
+    cur = con.execute(
+        "INSERT OR IGNORE INTO Blobs (digest, path, ref_count) VALUES (?, ?, 1)",
+        (digest, path)
+    )
+    if cur.rowcount:
+        return True
+    con.execute("UPDATE Blobs SET ref_count = ref_count + 1 WHERE digest = ?", (digest,))
+    return False
+
+
+# Count one user fewer. Returns the blob's digest if nothing refers to it any
+# more (so its files can go), otherwise None. Paths that are not blobs are ignored.
+def release(con, path):
+    row = con.execute("SELECT digest, ref_count FROM Blobs WHERE path = ?", (path,)).fetchone()
+    if row is None:
+        return None
+    con.execute("UPDATE Blobs SET ref_count = ref_count - 1 WHERE digest = ?", (row[0],))
+    return row[0] if row[1] <= 1 else None
+
+
+def is_blob(path):
+    return path.replace("\\", "/").startswith(BLOB_ROOT + '/')
+
+
+# Remove an unreferenced blob, its variants and their records. The row is deleted
+# first, which takes the write lock: a blob that was referenced again in the
+# meantime is kept.
+def delete_unreferenced(con, digest):
+    row = con.execute("SELECT path FROM Blobs WHERE digest = ?", (digest,)).fetchone()
+    if row is None:
+        return False
+    cur = con.execute("DELETE FROM Blobs WHERE digest = ? AND ref_count <= 0", (digest,))
+    if not cur.rowcount:
+        return False
+    paths = {row[0]}
+    paths.update(path for (path,) in con.execute(
+        "SELECT path FROM ImageVariants WHERE image_path = ? AND format NOT IN ('pending', 'unavailable')", (row[0],)
+    ))
+    con.execute("DELETE FROM ImageVariants WHERE image_path = ?", (row[0],))
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    return True
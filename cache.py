@@ -0,0 +1,139 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+# Optional cache backend shared by every worker process on the host: a small
+# SQLite file holding JSON-encoded entries and a generation number per cache.
+# Bumping the generation invalidates the cache in all workers at once.
+class SharedStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connect(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            con.execute("PRAGMA journal_mode = WAL")
+            con.execute("PRAGMA synchronous = OFF")
+            con.execute("CREATE TABLE IF NOT EXISTS CacheEntries (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+            con.execute("CREATE TABLE IF NOT EXISTS CacheGenerations (name TEXT PRIMARY KEY, generation INTEGER NOT NULL)")
+        return con
+
+    def generation(self, name):
+        row = self._connect().execute("SELECT generation FROM CacheGenerations WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0
+
+    def bump(self, name):
+        con = self._connect()
+        con.execute("""
+            INSERT INTO CacheGenerations (name, generation) VALUES (?, 1)
+            ON CONFLICT(name) DO UPDATE SET generation = generation + 1
+        """, (name,))
+        con.execute("DELETE FROM CacheEntries WHERE key LIKE ? ESCAPE '\\'", (name.replace('_', '\\_') + ':%',))
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT value FROM CacheEntries WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else MISSING
+
+    def set(self, key, value, ttl):
+        self._connect().execute(
+            "INSERT OR REPLACE INTO CacheEntries (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl)
+        )
+
+
+# In-process LRU cache whose entries expire after `ttl` seconds. With a shared
+# store, misses fall back to entries computed by other workers and invalidation
+# reaches every worker.
+class TTLCache:
+    def __init__(self, name, maxsize=128, ttl=60, store=None):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.store = store
+        self._entries = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _current_generation(self):
+        if self.store is None:
+            return self._generation
+        return self.store.generation(self.name)
+
+    def get(self, key):
+        generation = self._current_generation()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at, entry_generation = entry
+                if expires_at > now and entry_generation == generation:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.store is not None:
+            value = self.store.get(f"{self.name}:{generation}:{key}")
+            if value is not MISSING:
+                self._remember(key, value, generation)
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return MISSING
+
+    def _remember(self, key, value, generation):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl, generation)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def set(self, key, value, generation=None):
+        if generation is None:
+            generation = self._current_generation()
+        self._remember(key, value, generation)
+        if self.store is not None:
+            self.store.set(f"{self.name}:{generation}:{key}", value, self.ttl)
+
+    # Return the cached value, computing and caching it on a miss. The value is
+    # stored under the generation seen before computing, so a result that raced
+    # with an invalidation is never served afterwards.
+    def get_or_set(self, key, compute):
+        generation = self._current_generation()
+        value = self.get(key)
+        if value is MISSING:
+            value = compute()
+            self.set(key, value, generation)
+        return value
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+        if self.store is not None:
+            self.store.bump(self.name)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,54 @@
+import os
+import sys
+import tempfile
+
+# Writes made on the app's pooled connections (querylog.InstrumentedConnection)
+# must reach the database, executemany included. messaging.send_message writes
+# both Conversations rows that way and images.record_pending the upload marker;
+# the benchmark seeder uses a plain connection, so it would not notice.
+
+
+def check():
+    directory = tempfile.mkdtemp()
+    # app reads DATABASE when it is imported and migrates the new file
+    os.environ['DATABASE'] = os.path.join(directory, 'check.db')
+    import app
+    from images import record_pending
+    from messaging import send_message
+
+    failures = []
+    pool = app.get_db_pool()
+    con, _ = pool.checkout()
+    try:
+        users = [
+            con.execute("INSERT INTO Users (name, email, password) VALUES (?, ?, ?)",
+                        (name, f"{name}@example.com", 'x')).lastrowid
+            for name in ('sender', 'receiver')
+        ]
+        send_message(con, users[0], users[1], 'hello', '2024-01-01 12:00:00')
+        record_pending(con, 'static/blobs/ch/ec/check.jpg')
+        con.commit()
+
+        conversations = con.execute(
+            "SELECT user_id, unread_count FROM Conversations ORDER BY user_id"
+        ).fetchall()
+        if conversations != [(users[0], 0), (users[1], 1)]:
+            failures.append(f"send_message: expected both Conversations rows, found {conversations}")
+        pending = con.execute(
+            "SELECT format FROM ImageVariants WHERE image_path = 'static/blobs/ch/ec/check.jpg'"
+        ).fetchall()
+        if pending != [('pending',)]:
+            failures.append(f"record_pending: expected the pending marker, found {pending}")
+    finally:
+        pool.checkin(con)
+        pool.close()
+    return failures
+
+
+if __name__ == '__main__':
+    failures = check()
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+    print("Pooled connections write everything they are given.")
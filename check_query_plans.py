@@ -0,0 +1,103 @@
+import ast
+import re
+import sqlite3
+import sys
+
+import listings
+from migrations import DATABASE, migrate
+
+# Modules whose inline SQL is checked
+SOURCES = ['app.py']
+
+# Tables that grow with neighborhood activity. A full scan of any of these is a bug.
+LARGE_TABLES = {
+    'ResourceReservations', 'SpaceReservations', 'EventAttendance', 'Messages',
+    'Reviews', 'ResourceReviews', 'SpaceReviews', 'Conversations',
+}
+
+# Statements that are allowed to scan a large table, with the reason why.
+# Keys are the normalized statement text (see normalize()).
+ALLOWED_SCANS = {
+    "SELECT 'User Review' AS type, u.name AS item_name, r.rating, r.comment, r.timestamp, r.review_id AS review_id FROM Reviews r JOIN Users u ON r.user_id = u.user_id UNION ALL SELECT 'Resource Review' AS type, res.title AS item_name, rr.rating, rr.comment, rr.timestamp, rr.review_id AS review_id FROM ResourceReviews rr JOIN Resources res ON rr.resource_id = res.resource_id UNION ALL SELECT 'Space Review' AS type, s.title AS item_name, sr.rating, sr.comment, sr.timestamp, sr.review_id AS review_id FROM SpaceReviews sr JOIN Spaces s ON sr.space_id = s.space_id":
+        "view_all_reviews lists every review; paginate() adds the keyset range and each arm walks its timestamp index",
+}
+
+SQL_START = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+SCAN = re.compile(r'^SCAN (\w+)')
+TABLE_ALIAS = re.compile(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|GROUP\b|ORDER\b|LIMIT\b)(\w+))?', re.IGNORECASE)
+
+
+def normalize(sql):
+    sql = re.sub(r'--[^\n]*', '', sql)
+    return ' '.join(sql.split())
+
+
+# Every string literal in the source file that looks like a SQL statement
+def find_statements(path):
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    # Pieces of f-strings are only fragments of a statement
+    fragments = {id(value) for node in ast.walk(tree) if isinstance(node, ast.JoinedStr) for value in node.values}
+    statements = []
+    for node in ast.walk(tree):
+        if id(node) in fragments:
+            continue
+        if isinstance(node, ast.Constant) and isinstance(node.value, str) and SQL_START.match(node.value):
+            statements.append((node.lineno, node.value))
+    return sorted(statements)
+
+
+# Query plans name tables by their alias, so map aliases back to table names
+def table_aliases(sql):
+    aliases = {}
+    for table, alias in TABLE_ALIAS.findall(sql):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def full_scans(con, sql):
+    params = (None,) * sql.count('?')
+    plan = con.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    aliases = table_aliases(sql)
+    scans = []
+    for row in plan:
+        match = SCAN.match(row[3])
+        if match and aliases.get(match.group(1), match.group(1)) in LARGE_TABLES:
+            scans.append(row[3])
+    return scans
+
+
+def check(database=DATABASE):
+    # Work on an in-memory copy so the check never modifies the real database
+    source = sqlite3.connect(database)
+    con = sqlite3.connect(':memory:')
+    source.backup(con)
+    source.close()
+    migrate(con)
+
+    # Inline SQL by line number, then the statements listings.py builds for each kind
+    statements = [(path, lineno, sql) for path in SOURCES for lineno, sql in find_statements(path)]
+    statements += [(f"listings.py ({kind.name})", name, sql)
+                   for kind in listings.KINDS.values() for name, sql in kind.statements()]
+
+    failures = []
+    for path, where, sql in statements:
+        if normalize(sql) in ALLOWED_SCANS:
+            continue
+        scans = full_scans(con, sql)
+        if scans:
+            failures.append((path, where, normalize(sql), scans))
+    con.close()
+    return failures
+
+
+if __name__ == '__main__':
+    failures = check(sys.argv[1] if len(sys.argv) > 1 else DATABASE)
+    for path, where, sql, scans in failures:
+        print(f"{path}:{where}: {', '.join(scans)}\n    {sql}\n")
+    if failures:
+        print(f"{len(failures)} statement(s) do a full scan of a large table.")
+        sys.exit(1)
+    print("No full scans of large tables.")
@@ -0,0 +1,147 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Pragmas applied to every pooled connection. WAL lets readers keep going while a
+# writer commits, and NORMAL sync is safe under WAL (only the last commit can be
+# lost on power failure, the database itself never corrupts).
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -20000),        # ~20 MB page cache per connection
+    ("mmap_size", 268435456),      # 256 MB memory-mapped reads
+    ("temp_store", "MEMORY"),
+    ("busy_timeout", 5000),        # wait up to 5s for a write lock instead of failing
+)
+
+
+# Prepared statements kept per connection (sqlite3's default is 128)
+STATEMENT_CACHE_SIZE = 256
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# Keeps a fixed number of warm connections for the current process
+class ConnectionPool:
+    def __init__(self, database, size=5, timeout=10.0, factory=sqlite3.Connection):
+        self.database = database
+        self.factory = factory
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+        # Checkout wait statistics
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _connect(self):
+        # Connections are handed between request threads, so they must not be
+        # pinned to the thread that opened them
+        # Room in the prepared-statement cache for every statement the app runs
+        # (inline SQL plus each listing kind's, see listings.py), so none is re-parsed
+        con = sqlite3.connect(self.database, timeout=self.timeout, check_same_thread=False, factory=self.factory,
+                              cached_statements=STATEMENT_CACHE_SIZE)
+        for name, value in PRAGMAS:
+            con.execute(f"PRAGMA {name} = {value}")
+        return con
+
+    def checkout(self):
+        start = time.perf_counter()
+        try:
+            con = self._idle.get_nowait()
+        except queue.Empty:
+            con = None
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    con = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    con = self._idle.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+        wait = time.perf_counter() - start
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        return con, wait
+
+    def checkin(self, con):
+        # Never hand out a connection with a half-finished transaction
+        try:
+            if con.in_transaction:
+                con.rollback()
+        except sqlite3.Error:
+            con.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(con)
+
+    # Borrow a connection for the duration of a with block, for code that runs
+    # outside a request (streaming responses, background threads)
+    @contextmanager
+    def connection(self):
+        con, _ = self.checkout()
+        try:
+            yield con
+        finally:
+            self.checkin(con)
+
+    def close(self):
+        while True:
+            try:
+                con = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            con.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self._created,
+                "idle": self._idle.qsize(),
+                "checkouts": self.checkouts,
+                "avg_wait_ms": (self.total_wait / self.checkouts * 1000) if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Returns the pool for this process. Forked workers (gunicorn) must not share the
+# parent's SQLite handles, so pools are keyed by pid. `factory` is the connection
+# class, as for sqlite3.connect().
+def get_pool(database, size=5, factory=sqlite3.Connection):
+    key = (os.getpid(), database)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(database, size=size, factory=factory)
+    return pool
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+# Listing table and the date column events are counted by, for each kind counted
+# in CategoryCounts (kept up to date by triggers, see migrations.py). Resources
+# and spaces are counted with day ''.
+COUNTED = {
+    'resource': ('Resources', None),
+    'space': ('Spaces', None),
+    'event': ('Events', 'date'),
+}
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date().isoformat()
+    except (TypeError, ValueError):
+        return None
+
+
+# Structured filters from the query string of a listing page. Values that do not
+# parse are ignored, as if they had not been given.
+#   category            exact category
+#   owner               the owner's user id
+#   posted_since        listed on or after this date (resources, spaces)
+#   available_from/_to  not reserved on any day of this range (resources, spaces)
+#   date_from/_to       taking place in this range (events)
+class Filters:
+    def __init__(self, args):
+        self.category = args.get('category') or None
+        try:
+            self.owner = int(args['owner']) if args.get('owner') else None
+        except ValueError:
+            self.owner = None
+        self.posted_since = _date(args.get('posted_since'))
+        self.available_from, self.available_to = self._range(args, 'available_from', 'available_to')
+        self.date_from, self.date_to = self._range(args, 'date_from', 'date_to')
+
+    # A one-sided range covers just that day for availability; for event dates
+    # it is open-ended
+    @staticmethod
+    def _range(args, start_name, end_name):
+        start, end = _date(args.get(start_name)), _date(args.get(end_name))
+        if start and end and end < start:
+            start, end = end, start
+        return start, end
+
+    def active(self):
+        return any((self.category, self.owner, self.posted_since, self.available_from, self.available_to,
+                    self.date_from, self.date_to))
+
+
+# (category, listing count) for a kind, most listings first, from CategoryCounts
+# instead of counting the listing table. The user's own listings are not shown
+# on the listing pages, so they are taken off (through the owner's index). For
+# events only those on or after `since` are counted.
+def category_counts(con, kind, user_id, since=''):
+    table, day_column = COUNTED[kind]
+    counts = dict(con.execute(
+        "SELECT category, SUM(listing_count) FROM CategoryCounts WHERE kind = ? AND day >= ? GROUP BY category",
+        (kind, since)
+    ).fetchall())
+    if user_id is not None:
+        own_since = f" AND {day_column} >= ?" if day_column else ''
+        own = con.execute(
+            f"SELECT category, COUNT(*) FROM {table} WHERE user_id = ?{own_since} AND category IS NOT NULL GROUP BY category",
+            (user_id, since) if day_column else (user_id,)
+        ).fetchall()
+        for category, count in own:
+            if category in counts:
+                counts[category] -= count
+    return sorted(((c, n) for c, n in counts.items() if n > 0), key=lambda item: (-item[1], item[0]))
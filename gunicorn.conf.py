@@ -0,0 +1,96 @@
+import multiprocessing
+import os
+
+# Production server settings, used with: gunicorn -c gunicorn.conf.py wsgi:app
+# Every setting can be overridden from the environment.
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+
+# Each worker writes its metrics (metrics.py) here so /metrics can add them up.
+# Set before the app is imported; emptied when the server starts.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-metrics')
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+# Workers share the homepage cache (cache.SharedStore) through this file, so a
+# write handled by one worker invalidates the cache in all of them. Emptied when
+# the server starts.
+os.environ.setdefault('CACHE_STORE', '/tmp/smart-neighborhood-cache.db')
+
+# SQLite allows one writer at a time, so more processes only add lock contention
+# on writes; a few processes with several threads each keep reads concurrent
+# (WAL) without that. Threads also keep the long-lived message streams (SSE and
+# long polling) from tying up a whole process each.
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 4)))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# One pooled database connection per thread, so no request waits for a connection
+os.environ.setdefault('DB_POOL_SIZE', str(threads))
+
+# Each worker also runs the background job worker (jobs.py) on a thread; workers
+# take turns claiming jobs. Set to 0 when `python jobs.py work` runs separately.
+run_jobs = os.environ.get('RUN_JOB_WORKER', '1') != '0'
+
+# Import the app (migrations, templates) once in the master and fork workers
+# from it, so they start warm and share its memory copy-on-write. Code changes
+# then need a full restart; HUP only replaces the workers.
+preload_app = True
+
+# A worker that stops answering the master for this long is killed and replaced.
+# With threads this does not limit request time, so long polls and streams are safe.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+# On shutdown or HUP, workers get this long to finish requests in flight
+graceful_timeout = 30
+# Keep idle client connections open between requests. Behind a proxy, keep this
+# longer than the proxy's idle timeout for upstream connections.
+keepalive = 5
+
+# Replace each worker after this many requests (with jitter so they do not all
+# restart together) to bound any slow memory growth
+max_requests = 1000
+max_requests_jitter = 100
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    from metrics import clear_multiprocess_dir
+    clear_multiprocess_dir()
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(os.environ['CACHE_STORE'] + suffix):
+            os.remove(os.environ['CACHE_STORE'] + suffix)
+
+
+def when_ready(server):
+    server.log.info("Serving on %s with %s workers x %s threads", bind, workers, threads)
+
+
+def on_reload(server):
+    server.log.info("Reload requested: replacing workers gracefully")
+
+
+def post_fork(server, worker):
+    server.log.info("Worker %s started", worker.pid)
+    if run_jobs:
+        import threading
+        from app import DATABASE
+        from jobs import start_worker_thread
+        worker.jobs_stop = threading.Event()
+        start_worker_thread(DATABASE, worker.jobs_stop)
+
+
+# Stop the job thread after its current job, and close the worker's pooled
+# database connections so SQLite checkpoints the WAL and releases its locks cleanly
+def worker_exit(server, worker):
+    from app import get_db_pool
+    stop = getattr(worker, 'jobs_stop', None)
+    if stop is not None:
+        stop.set()
+    get_db_pool().close()
+
+
+# Drop the live gauges (requests in flight) of a worker that is gone
+def child_exit(server, worker):
+    from metrics import mark_worker_dead
+    mark_worker_dead(worker.pid)
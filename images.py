@@ -0,0 +1,250 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import uuid
+
+from PIL import Image, ImageOps
+
+from migrations import DATABASE
+
+# Largest request body accepted, so oversized uploads are refused before they are read
+MAX_UPLOAD_BYTES = 16 * 1024 * 1024
+# Longest side of a stored image; larger uploads are scaled down
+MAX_DIMENSION = 2048
+# Refuse images that would decode to more pixels than this (decompression bombs)
+Image.MAX_IMAGE_PIXELS = 40_000_000
+
+# Widths of the thumbnails generated for srcset. Listing cells show images at
+# 80-150 CSS pixels, so these cover 1x-4x displays.
+THUMBNAIL_WIDTHS = (160, 320, 640)
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+# Pillow format and file extension each upload is re-encoded to. GIFs become
+# PNGs (first frame only).
+OUTPUT_FORMATS = {
+    'JPEG': ('JPEG', 'jpg'),
+    'PNG': ('PNG', 'png'),
+    'GIF': ('PNG', 'png'),
+}
+
+
+# Shown in place of an image while its upload is being processed, and instead
+# of an upload that could not be processed
+PLACEHOLDER = 'static/images/placeholder.svg'
+UNAVAILABLE = 'static/images/unavailable.svg'
+
+# Every column that stores an uploaded image's path
+IMAGE_COLUMNS = (('Users', 'profile_image'), ('Resources', 'images'), ('Spaces', 'images'), ('Events', 'images'))
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def _save(image, path, image_format):
+    if image_format == 'JPEG':
+        image.convert('RGB').save(path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    elif image_format == 'WEBP':
+        image.save(path, 'WEBP', quality=WEBP_QUALITY, method=6)
+    else:
+        image.save(path, image_format, optimize=True)
+
+
+def _resized(image, width):
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+# Open an uploaded file as an image, upright and in a mode every output format can take
+def load_image(stream):
+    try:
+        image = Image.open(stream)
+        source_format = image.format
+        image = ImageOps.exif_transpose(image)
+    except (OSError, SyntaxError, Image.DecompressionBombError) as e:
+        raise InvalidImage(str(e))
+    if source_format not in OUTPUT_FORMATS:
+        raise InvalidImage(f"Unsupported image format {source_format}")
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image, source_format
+
+
+def _path(folder, name):
+    return os.path.join(folder, name).replace("\\", "/")
+
+
+# Thumbnails narrower than the image in its own format and as WebP, plus a
+# full-size WebP. Returns (format, width, path) for each file written.
+def generate_variants(image, image_format, folder, stem):
+    extension = 'jpg' if image_format == 'JPEG' else 'png'
+    os.makedirs(folder, exist_ok=True)
+    variants = []
+    for width in [w for w in THUMBNAIL_WIDTHS if w < image.width] + [image.width]:
+        resized = image if width == image.width else _resized(image, width)
+        if width != image.width:
+            path = _path(folder, f"{stem}.{width}w.{extension}")
+            _save(resized, path, image_format)
+            variants.append(('original', width, path))
+        path = _path(folder, f"{stem}.{width}w.webp")
+        _save(resized, path, 'WEBP')
+        variants.append(('webp', width, path))
+    return variants
+
+
+# Store an uploaded image in `folder` with its variants. Re-encoding drops all
+# metadata the upload carried (EXIF, GPS position, comments) and caps its size.
+# Returns the stored image's path and its (format, width, path) variants, the
+# stored image itself included.
+def save_upload(stream, folder, stem):
+    image, source_format = load_image(stream)
+    if max(image.size) > MAX_DIMENSION:
+        image.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+    image_format, extension = OUTPUT_FORMATS[source_format]
+    os.makedirs(folder, exist_ok=True)
+
+    path = _path(folder, f"{stem}.{extension}")
+    _save(image, path, image_format)
+    return path, [('original', image.width, path)] + generate_variants(image, image_format, folder, stem)
+
+
+# Fast, in-request half of an upload: check the file header (no decoding), then
+# copy the untouched upload to the staging folder for the job worker, hashing it
+# on the way. Returns the processed image's file extension, the staged file's
+# path and the upload's SHA-256 hex digest.
+def stage_upload(stream, staging_folder):
+    try:
+        source_format = Image.open(stream).format
+    except (OSError, SyntaxError) as e:
+        raise InvalidImage(str(e))
+    if source_format not in OUTPUT_FORMATS:
+        raise InvalidImage(f"Unsupported image format {source_format}")
+    stream.seek(0)
+
+    os.makedirs(staging_folder, exist_ok=True)
+    staged_path = _path(staging_folder, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    with open(staged_path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(65536), b''):
+            digest.update(chunk)
+            f.write(chunk)
+    return OUTPUT_FORMATS[source_format][1], staged_path, digest.hexdigest()
+
+
+# Slow half of an upload, run by the job worker: re-encode the staged file into
+# its final place and write the variants. The staged copy is left for
+# discard_staged once the result is committed.
+def process_staged(staged_path, folder, stem):
+    with open(staged_path, 'rb') as f:
+        return save_upload(f, folder, stem)
+
+
+def discard_staged(staged_path):
+    if os.path.exists(staged_path):
+        os.remove(staged_path)
+
+
+# Delete an image that is not in the blob store (uploaded before it existed) and
+# its variants, once nothing refers to it any more
+def delete_image(con, image_path):
+    for table, column in IMAGE_COLUMNS:
+        if con.execute(f"SELECT 1 FROM {table} WHERE {column} = ? LIMIT 1", (image_path,)).fetchone():
+            return False
+    paths = {image_path.replace("\\", "/")}
+    paths.update(path for (path,) in con.execute(
+        "SELECT path FROM ImageVariants WHERE image_path = ? AND format NOT IN ('pending', 'unavailable')", (image_path,)
+    ))
+    con.execute("DELETE FROM ImageVariants WHERE image_path = ?", (image_path,))
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    return True
+
+
+# Replace the variants recorded for an image. Runs in the caller's transaction.
+def record_variants(con, image_path, variants):
+    con.execute("DELETE FROM ImageVariants WHERE image_path = ?", (image_path,))
+    con.executemany(
+        "INSERT INTO ImageVariants (image_path, format, width, path) VALUES (?, ?, ?, ?)",
+        [(image_path, image_format, width, path) for image_format, width, path in variants]
+    )
+
+
+# Mark an image as waiting for the job worker. record_variants replaces the marker.
+def record_pending(con, image_path):
+    record_variants(con, image_path, [('pending', 0, PLACEHOLDER)])
+
+
+# Mark an image whose upload could not be processed
+def record_unavailable(con, image_path):
+    record_variants(con, image_path, [('unavailable', 0, UNAVAILABLE)])
+
+
+# srcset strings for an image, from its recorded variants: {'original': ..., 'webp': ...},
+# or {'pending': <placeholder URL>} while the upload is being processed and
+# {'unavailable': <placeholder URL>} if it could not be
+def srcsets(con, image_path):
+    return srcsets_for(con, [image_path])[image_path]
+
+
+# srcsets() of several images with one query: {image_path: srcsets}
+def srcsets_for(con, image_paths):
+    image_paths = list(dict.fromkeys(image_paths))
+    sets = {image_path: {} for image_path in image_paths}
+    markers = {}
+    for image_path, image_format, width, path in con.execute(
+        f"SELECT image_path, format, width, path FROM ImageVariants WHERE image_path IN ({', '.join('?' * len(image_paths))}) "
+        "ORDER BY image_path, format, width",
+        image_paths
+    ):
+        if image_format in ('pending', 'unavailable'):
+            markers[image_path] = {image_format: f"/{path}"}
+        sets[image_path].setdefault(image_format, []).append(f"/{path} {width}w")
+    return {
+        image_path: markers.get(image_path) or {image_format: ', '.join(entries) for image_format, entries in formats.items()}
+        for image_path, formats in sets.items()
+    }
+
+
+# Generate variants for images uploaded before this pipeline existed. Originals
+# are left untouched; only missing variants are added.
+def backfill(con):
+    done = 0
+    for table, column in IMAGE_COLUMNS:
+        for (image_path,) in con.execute(f"""
+            SELECT DISTINCT {column} FROM {table}
+            WHERE {column} IS NOT NULL
+            AND {column} NOT IN (SELECT image_path FROM ImageVariants)
+        """).fetchall():
+            # Paths saved on Windows use backslashes
+            file_path = image_path.replace("\\", "/")
+            if not os.path.exists(file_path):
+                continue
+            try:
+                with open(file_path, 'rb') as f:
+                    image, source_format = load_image(f)
+            except InvalidImage:
+                continue
+            variants = [('original', image.width, file_path)]
+            if max(image.size) > MAX_DIMENSION:
+                image.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+            folder, name = os.path.split(file_path)
+            stem = os.path.splitext(name)[0]
+            variants += generate_variants(image, OUTPUT_FORMATS[source_format][0], folder, stem)
+            with con:
+                record_variants(con, image_path, variants)
+            done += 1
+    return done
+
+
+# python images.py backfill [database]
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'backfill':
+        print("usage: python images.py backfill [database]")
+        sys.exit(2)
+    connection = sqlite3.connect(sys.argv[2] if len(sys.argv) > 2 else DATABASE)
+    count = backfill(connection)
+    connection.close()
+    print(f"Generated variants for {count} images.")
@@ -0,0 +1,218 @@
+import json
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+
+import blobstore
+import images
+from migrations import DATABASE
+
+# Seconds an idle worker sleeps between checks for new jobs
+POLL_INTERVAL = 1.0
+# Failed jobs are retried this many times in total, waiting longer each time
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30
+# A job still running after this many seconds is assumed to belong to a dead
+# worker and is handed out again
+JOB_TIMEOUT = 300
+# Finished jobs are kept this long for the latency figures in queue_stats()
+KEEP_DONE_SECONDS = 24 * 3600
+
+HANDLERS = {}
+FAILURE_HANDLERS = {}
+
+
+# Register the function that runs jobs of a kind. Handlers get a connection and
+# the job's payload; their database writes commit together with the job's
+# completion. A handler may return a function to call once that has committed
+# (e.g. to delete files the job no longer needs).
+def handler(kind):
+    def register(function):
+        HANDLERS[kind] = function
+        return function
+    return register
+
+
+# Register the function that cleans up after a job of a kind has failed for the
+# last time. Same arguments and return value as a handler; its writes commit
+# together with the job's failed status.
+def on_failure(kind):
+    def register(function):
+        FAILURE_HANDLERS[kind] = function
+        return function
+    return register
+
+
+# Add a job to the queue. Runs in the caller's transaction, so the job only
+# exists if the request that created it commits.
+def enqueue(con, kind, payload):
+    now = time.time()
+    return con.execute(
+        "INSERT INTO Jobs (kind, payload, status, attempts, enqueued_at, run_after) VALUES (?, ?, 'queued', 0, ?, ?)",
+        (kind, json.dumps(payload), now, now)
+    ).lastrowid
+
+
+# Take the oldest job that is due, or None. BEGIN IMMEDIATE makes concurrent
+# workers take turns, so each job is handed to exactly one of them.
+def claim(con):
+    now = time.time()
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.execute(
+            "UPDATE Jobs SET status = 'queued', run_after = ? WHERE status = 'running' AND started_at < ?",
+            (now, now - JOB_TIMEOUT)
+        )
+        job = con.execute("""
+            SELECT job_id, kind, payload, attempts FROM Jobs
+            WHERE status = 'queued' AND run_after <= ?
+            ORDER BY run_after, job_id
+            LIMIT 1
+        """, (now,)).fetchone()
+        if job is not None:
+            con.execute(
+                "UPDATE Jobs SET status = 'running', attempts = attempts + 1, started_at = ? WHERE job_id = ?",
+                (now, job[0])
+            )
+    except Exception:
+        con.rollback()
+        raise
+    con.commit()
+    return job
+
+
+def run(con, job):
+    job_id, kind, payload, attempts = job
+    after_commit = None
+    try:
+        after_commit = HANDLERS[kind](con, json.loads(payload))
+        con.execute("UPDATE Jobs SET status = 'done', finished_at = ?, error = NULL WHERE job_id = ?", (time.time(), job_id))
+        con.commit()
+    except Exception:
+        con.rollback()
+        error = traceback.format_exc()
+        after_commit = None
+        if attempts + 1 >= MAX_ATTEMPTS:
+            con.execute("UPDATE Jobs SET status = 'failed', finished_at = ?, error = ? WHERE job_id = ?", (time.time(), error, job_id))
+            if kind in FAILURE_HANDLERS:
+                after_commit = FAILURE_HANDLERS[kind](con, json.loads(payload))
+        else:
+            con.execute(
+                "UPDATE Jobs SET status = 'queued', run_after = ?, error = ? WHERE job_id = ?",
+                (time.time() + RETRY_DELAY * (attempts + 1), error, job_id)
+            )
+        con.commit()
+    if after_commit is not None:
+        after_commit()
+
+
+# Run due jobs until the queue is empty. Returns the number of jobs run.
+def work_once(con):
+    count = 0
+    while True:
+        job = claim(con)
+        if job is None:
+            return count
+        run(con, job)
+        count += 1
+
+
+def prune(con):
+    with con:
+        con.execute("DELETE FROM Jobs WHERE status = 'done' AND finished_at < ?", (time.time() - KEEP_DONE_SECONDS,))
+
+
+# Worker loop: run jobs as they arrive, forever
+def work(database=DATABASE, stop=None):
+    con = sqlite3.connect(database, timeout=10)
+    con.execute("PRAGMA journal_mode = WAL")
+    last_prune = 0
+    try:
+        while stop is None or not stop.is_set():
+            work_once(con)
+            if time.time() - last_prune > 3600:
+                prune(con)
+                last_prune = time.time()
+            time.sleep(POLL_INTERVAL)
+    finally:
+        con.close()
+
+
+# Run the worker on a daemon thread of the current process (the development
+# server, each gunicorn worker). Setting `stop` ends it after the current job.
+def start_worker_thread(database=DATABASE, stop=None):
+    thread = threading.Thread(target=work, args=(database, stop), name='job-worker', daemon=True)
+    thread.start()
+    return thread
+
+
+# Queue depth and latency: how many jobs are waiting, how long the oldest has
+# waited, and the average wait and run time of jobs finished in the last hour
+def queue_stats(con):
+    now = time.time()
+    counts = dict(con.execute("SELECT status, COUNT(*) FROM Jobs GROUP BY status").fetchall())
+    oldest = con.execute("SELECT MIN(enqueued_at) FROM Jobs WHERE status = 'queued'").fetchone()[0]
+    avg_wait, avg_run, finished = con.execute("""
+        SELECT AVG(started_at - enqueued_at), AVG(finished_at - started_at), COUNT(*)
+        FROM Jobs WHERE status = 'done' AND finished_at >= ?
+    """, (now - 3600,)).fetchone()
+    return {
+        "queued": counts.get('queued', 0),
+        "running": counts.get('running', 0),
+        "failed": counts.get('failed', 0),
+        "oldest_queued_age_s": now - oldest if oldest is not None else 0.0,
+        "finished_last_hour": finished,
+        "avg_wait_s": avg_wait or 0.0,
+        "avg_run_s": avg_run or 0.0,
+    }
+
+
+# Staged files are only deleted once the outcome is committed, so a retry
+# still has its upload
+def _remove_staged(payload):
+    return lambda: images.discard_staged(payload['staged_path'])
+
+
+@handler('process_image')
+def process_image(con, payload):
+    image_path, variants = images.process_staged(payload['staged_path'], payload['folder'], payload['stem'])
+    images.record_variants(con, image_path, variants)
+    return _remove_staged(payload)
+
+
+# An upload that cannot be processed (e.g. a valid header on a truncated file)
+# is shown as unavailable instead of as processing forever
+@on_failure('process_image')
+def image_failed(con, payload):
+    row = con.execute("SELECT path FROM Blobs WHERE digest = ?", (payload['stem'],)).fetchone()
+    if row is not None:
+        images.record_unavailable(con, row[0])
+    return _remove_staged(payload)
+
+
+@handler('delete_image')
+def delete_image(con, payload):
+    images.delete_image(con, payload['image_path'])
+
+
+@handler('delete_blob')
+def delete_blob(con, payload):
+    blobstore.delete_unreferenced(con, payload['digest'])
+
+
+# python jobs.py work [database]   - run a worker
+# python jobs.py stats [database]  - print queue depth and latency
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in ('work', 'stats'):
+        print("usage: python jobs.py work|stats [database]")
+        sys.exit(2)
+    database = sys.argv[2] if len(sys.argv) > 2 else DATABASE
+    if sys.argv[1] == 'work':
+        print(f"Job worker running against {database}")
+        work(database)
+    else:
+        connection = sqlite3.connect(database)
+        print(json.dumps(queue_stats(connection), indent=2))
+        connection.close()
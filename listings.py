@@ -0,0 +1,210 @@
+from pagination import paginate
+
+# Shown instead of the owner's availability text while an item is reserved today
+AVAILABILITY = "CASE WHEN listing.is_reserved THEN 'Reserved' ELSE listing.availability END AS availability"
+
+
+# A kind of reservable listing (resources, spaces, ...) and every statement the
+# listing and reservation pages run for it. Each kind's statements are built once,
+# so every request sends SQLite the same text and reuses its prepared statement.
+# A new kind needs its tables (listing, reservations, full-text index), an entry
+# in KINDS, its templates and its routes.
+class ListingKind:
+    def __init__(self, name, plural, table, id_column, reservations, fts):
+        self.name = name
+        self.plural = plural
+        self.table = table
+        self.id_column = id_column
+        self.reservations = reservations
+        self.fts = fts
+
+        # Everyone else's listings, newest first / ranked by a full-text search
+        self.browse_sql = f"""
+            SELECT listing.{id_column}, u.name AS user_name, listing.title, listing.description, listing.images,
+                   listing.category, {AVAILABILITY}, listing.date_posted, listing.user_id AS owner_id
+            FROM {table} listing
+            JOIN Users u ON listing.user_id = u.user_id
+            WHERE listing.user_id != ?
+        """
+        self.search_sql = f"""
+            SELECT listing.{id_column}, u.name AS user_name, listing.title, listing.description, listing.images,
+                   listing.category, {AVAILABILITY}, listing.date_posted, listing.user_id AS owner_id,
+                   {fts}.rank AS rank
+            FROM {fts}
+            JOIN {table} listing ON listing.{id_column} = {fts}.rowid
+            JOIN Users u ON listing.user_id = u.user_id
+            WHERE {fts} MATCH ?
+            AND listing.user_id != ?
+        """
+        # Structured filters (facets.Filters) that narrow browse_sql and
+        # search_sql, each "AND ..." with its parameters taken from the filters
+        self.filter_clauses = [
+            ('category', " AND listing.category = ?"),
+            ('owner', " AND listing.user_id = ?"),
+            ('posted_since', " AND listing.date_posted >= ?"),
+            # Not reserved on any day of the range; probes the same index as conflicts_sql
+            ('available', f"""
+            AND NOT EXISTS (
+                SELECT 1 FROM {reservations} reservation
+                WHERE reservation.{id_column} = listing.{id_column}
+                AND reservation.reservation_end_date >= ?
+                AND reservation.reservation_start_date <= ?
+            )"""),
+        ]
+        # The user's own listings
+        self.owned_sql = f"""
+            SELECT listing.{id_column}, listing.user_id, listing.title, listing.description, listing.images,
+                   listing.category, {AVAILABILITY}, listing.date_posted
+            FROM {table} listing
+            WHERE listing.user_id = ?
+        """
+        # Current and upcoming reservations of an item (past ones can never conflict)
+        self.upcoming_sql = f"""
+            SELECT reservation_start_date, reservation_end_date
+            FROM {reservations}
+            WHERE {id_column} = ? AND reservation_end_date >= ?
+            ORDER BY reservation_end_date
+        """
+        # Reservations overlapping a date range. Only those ending on or after its
+        # start can overlap; the ({id_column}, reservation_end_date,
+        # reservation_start_date) index finds them directly.
+        self.conflicts_sql = f"""
+            SELECT reservation_start_date, reservation_end_date
+            FROM {reservations}
+            WHERE {id_column} = ?
+            AND reservation_end_date >= ?
+            AND reservation_start_date <= ?
+        """
+        self.insert_reservation_sql = f"""
+            INSERT INTO {reservations} ({id_column}, user_id, reservation_start_date, reservation_end_date, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """
+        self.reserved_item_sql = f"SELECT {id_column} FROM {reservations} WHERE reservation_id = ? AND user_id = ?"
+        self.delete_reservation_sql = f"DELETE FROM {reservations} WHERE reservation_id = ? AND user_id = ?"
+        self.reset_availability_sql = f"UPDATE {table} SET availability = 'available' WHERE {id_column} = ? AND availability IS NOT 'available'"
+        # The user's reservations with the item and its owner's name
+        self.user_reservations_sql = f"""
+            SELECT reservation.reservation_id, listing.title, reservation.reservation_start_date,
+                   reservation.reservation_end_date, u.name AS reserved_from
+            FROM {reservations} reservation
+            JOIN {table} listing ON reservation.{id_column} = listing.{id_column}
+            JOIN Users u ON listing.user_id = u.user_id
+            WHERE reservation.user_id = ?
+        """
+        # is_reserved for one item / for every item, as of a day. Only rows whose
+        # status changes are written (flipped), so a rollover touches just the
+        # items whose reservations started or ended.
+        self.refresh_item_sql = f"""
+            UPDATE {table} SET is_reserved = NOT is_reserved
+            WHERE {id_column} = ?
+            AND is_reserved IS NOT EXISTS (
+                SELECT 1 FROM {reservations} reservation
+                WHERE reservation.{id_column} = {table}.{id_column}
+                AND reservation.reservation_end_date >= ?
+                AND reservation.reservation_start_date <= ?
+            )
+        """
+        self.refresh_all_sql = f"""
+            UPDATE {table} SET is_reserved = NOT is_reserved
+            WHERE is_reserved IS NOT EXISTS (
+                SELECT 1 FROM {reservations} reservation
+                WHERE reservation.{id_column} = {table}.{id_column}
+                AND reservation.reservation_end_date >= ?
+                AND reservation.reservation_start_date <= ?
+            )
+        """
+
+    # SQL to append to browse_sql / search_sql for the filters that are set, and
+    # its parameters
+    def filter_sql(self, filters):
+        values = {
+            'category': (filters.category,),
+            'owner': (filters.owner,),
+            'posted_since': (filters.posted_since,),
+            'available': (filters.available_from or filters.available_to,
+                          filters.available_to or filters.available_from),
+        }
+        sql, params = '', []
+        for name, clause in self.filter_clauses:
+            if values[name][0] is not None:
+                sql += clause
+                params += values[name]
+        return sql, params
+
+    # (name, SQL) of every statement, for check_query_plans.py. Browsing and
+    # searching are also checked with every filter applied.
+    def statements(self):
+        statements = [(name, sql) for name, sql in vars(self).items() if name.endswith('_sql')]
+        every_filter = ''.join(clause for _, clause in self.filter_clauses)
+        for name in ('browse_sql', 'search_sql'):
+            statements.append((f"{name} (filtered)", getattr(self, name) + every_filter))
+        return statements
+
+
+RESOURCES = ListingKind('resource', 'resources', 'Resources', 'resource_id', 'ResourceReservations', 'ResourcesFTS')
+SPACES = ListingKind('space', 'spaces', 'Spaces', 'space_id', 'SpaceReservations', 'SpacesFTS')
+
+KINDS = {kind.name: kind for kind in (RESOURCES, SPACES)}
+
+
+# One page of other users' listings: ranked matches for a full-text query, or
+# everything newest first without one, narrowed by any structured filters
+def browse(con, kind, user_id, search_match=None, filters=None):
+    where, params = kind.filter_sql(filters) if filters is not None else ('', [])
+    if search_match:
+        return paginate(con, kind.search_sql + where, [search_match, user_id] + params,
+                        ['rank', kind.id_column], descending=False, hidden=['rank'])
+    return paginate(con, kind.browse_sql + where, [user_id] + params, ['date_posted', kind.id_column])
+
+
+def owned(con, kind, user_id):
+    return con.execute(kind.owned_sql, (user_id,)).fetchall()
+
+
+def upcoming_reservations(con, kind, item_id, day):
+    return con.execute(kind.upcoming_sql, (item_id, day)).fetchall()
+
+
+def user_reservations(con, kind, user_id):
+    return con.execute(kind.user_reservations_sql, (user_id,)).fetchall()
+
+
+# Recompute is_reserved for a single item. Call inside the transaction that adds
+# or removes one of its reservations.
+def refresh_item(con, kind, item_id, day):
+    con.execute(kind.refresh_item_sql, (item_id, day, day))
+
+
+# Book an item for start..end (dates) unless that overlaps a reservation, and
+# commit. Returns the conflicting reservations, empty if the booking was made.
+def reserve(con, kind, item_id, user_id, start_date, end_date, created_at, today):
+    # Take the write lock before checking for overlaps, so no other request can
+    # book the same dates between the check and the insert
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        conflicts = con.execute(kind.conflicts_sql, (item_id, start_date, end_date)).fetchall()
+        if conflicts:
+            con.rollback()
+            return conflicts
+        con.execute(kind.insert_reservation_sql, (item_id, user_id, start_date, end_date, created_at))
+        # Keep the listing's Reserved status in step with the new reservation
+        refresh_item(con, kind, item_id, today)
+    except Exception:
+        con.rollback()
+        raise
+    con.commit()
+    return []
+
+
+# Cancel one of the user's reservations and commit. Returns False if the user
+# has no such reservation.
+def cancel(con, kind, reservation_id, user_id, today):
+    row = con.execute(kind.reserved_item_sql, (reservation_id, user_id)).fetchone()
+    if row is None:
+        return False
+    con.execute(kind.delete_reservation_sql, (reservation_id, user_id))
+    con.execute(kind.reset_availability_sql, (row[0],))
+    # Recompute the Reserved status now that this reservation is gone
+    refresh_item(con, kind, row[0], today)
+    con.commit()
+    return True
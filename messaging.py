@@ -0,0 +1,38 @@
+# Characters of the latest message shown in the inbox
+PREVIEW_LENGTH = 80
+
+
+# Insert a message and update both participants' Conversations rows: the
+# receiver gets one more unread message, the sender's count is unchanged. Runs in
+# the caller's transaction, so the summary commits together with the message.
+def send_message(con, sender_id, receiver_id, content, timestamp):
+    message_id = con.execute("""
+        INSERT INTO Messages (sender_id, receiver_id, content, timestamp)
+        VALUES (?, ?, ?, ?)
+    """, (sender_id, receiver_id, content, timestamp)).lastrowid
+
+    preview = content[:PREVIEW_LENGTH]
+    con.executemany("""
+        INSERT INTO Conversations (user_id, other_user_id, last_message_id, last_message_time, last_sender_id, preview, unread_count)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, other_user_id) DO UPDATE SET
+            last_message_id = excluded.last_message_id,
+            last_message_time = excluded.last_message_time,
+            last_sender_id = excluded.last_sender_id,
+            preview = excluded.preview,
+            unread_count = unread_count + excluded.unread_count
+    """, [
+        (sender_id, receiver_id, message_id, timestamp, sender_id, preview, 0),
+        (receiver_id, sender_id, message_id, timestamp, sender_id, preview, 1),
+    ])
+    return message_id
+
+
+# Clear the unread count once the user has seen the latest messages. Returns
+# True if there was anything to clear (and so something to commit).
+def mark_read(con, user_id, other_user_id):
+    cur = con.execute("""
+        UPDATE Conversations SET unread_count = 0
+        WHERE user_id = ? AND other_user_id = ? AND unread_count > 0
+    """, (user_id, other_user_id))
+    return cur.rowcount > 0
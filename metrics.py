@@ -0,0 +1,127 @@
+import os
+import threading
+import time
+
+from flask import g, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+# With gunicorn every worker process keeps its own samples. prometheus_client
+# writes them to files in PROMETHEUS_MULTIPROC_DIR (set in gunicorn.conf.py
+# before the app is imported), and a scrape of any worker adds them all up.
+MULTIPROCESS = bool(os.environ.get('PROMETHEUS_MULTIPROC_DIR'))
+
+# Latency buckets in seconds: page renders are milliseconds, long polls 25s
+LATENCY_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+SIZE_BUCKETS = (16 * 1024, 64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', "Time to produce a response, by endpoint",
+    ['endpoint', 'method'], buckets=LATENCY_BUCKETS
+)
+REQUESTS = Counter('http_requests', "Responses sent, by endpoint and status", ['endpoint', 'method', 'status'])
+IN_FLIGHT = Gauge('http_requests_in_flight', "Requests being handled", multiprocess_mode='livesum')
+CHECKOUT_WAIT = Histogram(
+    'db_checkout_wait_seconds', "Time a request waited for a pooled database connection", buckets=FAST_BUCKETS
+)
+CACHE_LOOKUPS = Counter('cache_lookups', "Cache lookups, by cache and result (hit or miss)", ['cache', 'result'])
+UPLOADS = Counter('uploads', "Image uploads accepted, by whether the image was new or already stored", ['result'])
+UPLOAD_BYTES = Histogram('upload_size_bytes', "Size of accepted image uploads", buckets=SIZE_BUCKETS)
+RENDER_TIME = Histogram(
+    'template_render_seconds', "Template render time, by template", ['template'], buckets=FAST_BUCKETS
+)
+JOBS = Gauge('jobs', "Background jobs by status", ['status'], multiprocess_mode='mostrecent')
+OLDEST_JOB_AGE = Gauge(
+    'jobs_oldest_queued_age_seconds', "How long the oldest queued job has waited", multiprocess_mode='mostrecent'
+)
+
+
+# Prometheus metrics for the app: request latency and status per endpoint,
+# requests in flight, connection-pool waits, cache hit rates, uploads and
+# template render times. `caches` are the TTLCaches to report on; `renders` is
+# the app's templating.RenderStats.
+class Metrics:
+    def __init__(self, app, caches=(), renders=None):
+        self.app = app
+        self.caches = caches
+        self._lock = threading.Lock()
+        self._cache_counts = {}
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._done)
+        if renders is not None:
+            renders.listeners.append(self.observe_render)
+
+    def _start(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_in_flight = True
+        IN_FLIGHT.inc()
+
+    def _finish(self, response):
+        start = g.get('metrics_start')
+        if start is not None:
+            endpoint = request.endpoint or 'unmatched'
+            REQUEST_LATENCY.labels(endpoint, request.method).observe(time.perf_counter() - start)
+            REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+        self.sync_caches()
+        return response
+
+    def _done(self, exception):
+        if g.pop('metrics_in_flight', False):
+            IN_FLIGHT.dec()
+
+    def observe_checkout(self, wait):
+        CHECKOUT_WAIT.observe(wait)
+
+    def observe_upload(self, size, new):
+        UPLOADS.labels('new' if new else 'duplicate').inc()
+        UPLOAD_BYTES.observe(size)
+
+    def observe_render(self, template, ms):
+        RENDER_TIME.labels(template).observe(ms / 1000)
+
+    # Caches count their own hits and misses; add what changed since the last call
+    def sync_caches(self):
+        with self._lock:
+            for cache in self.caches:
+                stats = cache.stats()
+                hits, misses = self._cache_counts.get(cache.name, (0, 0))
+                if stats['hits'] > hits:
+                    CACHE_LOOKUPS.labels(cache.name, 'hit').inc(stats['hits'] - hits)
+                if stats['misses'] > misses:
+                    CACHE_LOOKUPS.labels(cache.name, 'miss').inc(stats['misses'] - misses)
+                self._cache_counts[cache.name] = (stats['hits'], stats['misses'])
+
+    # Queue depth, from jobs.queue_stats(). The queue is shared, so whichever
+    # worker was scraped last has the current figures.
+    def observe_jobs(self, stats):
+        for status in ('queued', 'running', 'failed'):
+            JOBS.labels(status).set(stats[status])
+        OLDEST_JOB_AGE.set(stats['oldest_queued_age_s'])
+
+    # Body and content type of a scrape: this process's metrics, or every
+    # worker's added up in multiprocess mode
+    def render(self):
+        self.sync_caches()
+        if MULTIPROCESS:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+            return generate_latest(registry), CONTENT_TYPE_LATEST
+        return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# gunicorn hooks (gunicorn.conf.py): start from an empty metrics directory, and
+# drop a worker's live gauges when it exits
+def clear_multiprocess_dir():
+    directory = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+
+
+def mark_worker_dead(pid):
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
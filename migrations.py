@@ -0,0 +1,590 @@
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+from messaging import PREVIEW_LENGTH
+
+# DATABASE in the environment points everything at another file (e.g. a benchmark database)
+DATABASE = os.environ.get('DATABASE', 'smart_neighborhood_exchange.db')
+
+# Rows updated per transaction when backfilling a column, so a large table is
+# never locked for longer than one small batch
+BACKFILL_BATCH_SIZE = 1000
+
+
+# Migration step that adds a column only if the table does not have it yet
+def add_column(table, column, definition):
+    def step(con):
+        columns = [row[1] for row in con.execute(f"PRAGMA table_info({table})")]
+        if column not in columns:
+            con.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return step
+
+
+# Base tables. Every statement is idempotent, so this is safe to run against a
+# database created by any earlier version of setup.py.
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS Users (
+        user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL UNIQUE,
+        password TEXT NOT NULL,
+        profile_image TEXT,
+        location TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Resources (
+        resource_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        title TEXT NOT NULL,
+        description TEXT,
+        images TEXT,
+        category TEXT,
+        availability TEXT,
+        date_posted TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES Users(user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Spaces (
+        space_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        title TEXT NOT NULL,
+        description TEXT,
+        images TEXT,
+        category TEXT,
+        availability TEXT,
+        date_posted TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES Users(user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Events (
+        event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        title TEXT NOT NULL,
+        description TEXT,
+        images TEXT,
+        category TEXT,
+        date TEXT NOT NULL,  -- Event date instead of availability
+        FOREIGN KEY (user_id) REFERENCES Users(user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Messages (
+        message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender_id INTEGER,
+        receiver_id INTEGER,
+        content TEXT NOT NULL,
+        timestamp TEXT NOT NULL,
+        FOREIGN KEY (sender_id) REFERENCES Users(user_id),
+        FOREIGN KEY (receiver_id) REFERENCES Users(user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Reviews (
+        review_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        reviewer_id INTEGER,
+        rating INTEGER NOT NULL,
+        comment TEXT,
+        timestamp TEXT NOT NULL,
+        FOREIGN KEY (user_id) REFERENCES Users(user_id),
+        FOREIGN KEY (reviewer_id) REFERENCES Users(user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ResourceReservations (
+        reservation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        resource_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        reservation_start_date TEXT NOT NULL,
+        reservation_end_date TEXT NOT NULL,
+        created_at TEXT,
+        FOREIGN KEY (resource_id) REFERENCES Resources(resource_id),
+        FOREIGN KEY (user_id) REFERENCES Users(user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS SpaceReservations (
+        reservation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        space_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        reservation_start_date TEXT NOT NULL,
+        reservation_end_date TEXT NOT NULL,
+        created_at TEXT,
+        FOREIGN KEY (space_id) REFERENCES Spaces(space_id),
+        FOREIGN KEY (user_id) REFERENCES Users(user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS EventAttendance (
+        attendance_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        created_at TEXT,
+        FOREIGN KEY (event_id) REFERENCES Events(event_id),
+        FOREIGN KEY (user_id) REFERENCES Users(user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS ResourceReviews (
+        review_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        resource_id INTEGER NOT NULL,
+        reviewer_id INTEGER NOT NULL,
+        rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),  -- Rating should be between 1 and 5
+        comment TEXT,
+        timestamp TEXT NOT NULL,
+        FOREIGN KEY (resource_id) REFERENCES Resources(resource_id),
+        FOREIGN KEY (reviewer_id) REFERENCES Users(user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS SpaceReviews (
+        review_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        space_id INTEGER NOT NULL,
+        reviewer_id INTEGER NOT NULL,
+        rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),  -- Rating should be between 1 and 5
+        comment TEXT,
+        timestamp TEXT NOT NULL,
+        FOREIGN KEY (space_id) REFERENCES Spaces(space_id),
+        FOREIGN KEY (reviewer_id) REFERENCES Users(user_id)
+    )
+    """,
+
+    # Databases created before reservations tracked when they were made
+    add_column('ResourceReservations', 'created_at', 'TEXT'),
+    add_column('SpaceReservations', 'created_at', 'TEXT'),
+    add_column('EventAttendance', 'created_at', 'TEXT'),
+]
+
+
+# Fill a column in batches of BACKFILL_BATCH_SIZE rowids. Each batch is its own
+# transaction and only touches rows that are still NULL, so an interrupted backfill
+# simply resumes where it stopped.
+def backfill(table, column, value):
+    def run(con):
+        max_rowid = con.execute(f"SELECT MAX(rowid) FROM {table}").fetchone()[0] or 0
+        value_now = value() if callable(value) else value
+        for low in range(0, max_rowid, BACKFILL_BATCH_SIZE):
+            with con:
+                con.execute(
+                    f"UPDATE {table} SET {column} = ? WHERE rowid > ? AND rowid <= ? AND {column} IS NULL",
+                    (value_now, low, low + BACKFILL_BATCH_SIZE)
+                )
+    return run
+
+
+def _listing_fts_insert(table, id_column, columns):
+    return f"""
+        INSERT INTO {table}FTS (rowid, {', '.join(columns)}, user_name)
+        VALUES (new.{id_column}, {', '.join(f"new.{c}" for c in columns)}, (SELECT name FROM Users WHERE user_id = new.user_id));
+    """
+
+
+# Trigger that re-indexes a listing when an indexed column or its owner changes.
+# Writes to other columns (is_reserved on every booking and daily rollover) leave
+# the index alone.
+def listing_fts_update(table, id_column, columns):
+    fts = f"{table}FTS"
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {', '.join(columns)}, user_id ON {table} BEGIN
+            DELETE FROM {fts} WHERE rowid = old.{id_column};
+            {_listing_fts_insert(table, id_column, columns)}
+        END
+        """
+
+
+# Full-text index for a listing table (Resources, Spaces, Events). The FTS row
+# shares the listing's id as its rowid and also indexes the owner's name, which
+# the search forms have always matched on.
+def listing_fts(table, id_column, columns):
+    fts = f"{table}FTS"
+    column_list = ', '.join(columns)
+    insert = _listing_fts_insert(table, id_column, columns)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({column_list}, user_name, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"""
+        INSERT INTO {fts} (rowid, {column_list}, user_name)
+        SELECT t.{id_column}, {', '.join(f't.{c}' for c in columns)}, u.name
+        FROM {table} t LEFT JOIN Users u ON t.user_id = u.user_id
+        """,
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        listing_fts_update(table, id_column, columns),
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN DELETE FROM {fts} WHERE rowid = old.{id_column}; END",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_owner_name AFTER UPDATE OF name ON Users BEGIN
+            UPDATE {fts} SET user_name = new.name
+            WHERE rowid IN (SELECT {id_column} FROM {table} WHERE user_id = new.user_id);
+        END
+        """,
+    ]
+
+
+# Full-text index for a review table: the review comment plus the name of the
+# thing being reviewed (a user's name, a resource or space title)
+def review_fts(table, subject_column, subject_table, subject_id, subject_name):
+    fts = f"{table}FTS"
+    subject = f"(SELECT {subject_name} FROM {subject_table} WHERE {subject_id} = new.{subject_column})"
+    insert = f"INSERT INTO {fts} (rowid, item_name, comment) VALUES (new.review_id, {subject}, new.comment);"
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(item_name, comment, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        f"""
+        INSERT INTO {fts} (rowid, item_name, comment)
+        SELECT r.review_id, s.{subject_name}, r.comment
+        FROM {table} r LEFT JOIN {subject_table} s ON r.{subject_column} = s.{subject_id}
+        """,
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert} END",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE ON {table} BEGIN
+            DELETE FROM {fts} WHERE rowid = old.review_id;
+            {insert}
+        END
+        """,
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN DELETE FROM {fts} WHERE rowid = old.review_id; END",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_subject_name AFTER UPDATE OF {subject_name} ON {subject_table} BEGIN
+            UPDATE {fts} SET item_name = new.{subject_name}
+            WHERE rowid IN (SELECT review_id FROM {table} WHERE {subject_column} = new.{subject_id});
+        END
+        """,
+    ]
+
+
+# Load the rating totals of one kind of subject from its review table. Replaces
+# existing rows so the step can be rerun.
+def rating_totals(kind, table, subject_column):
+    return f"""
+    INSERT OR REPLACE INTO RatingStats (subject_type, subject_id, review_count, rating_sum)
+    SELECT '{kind}', {subject_column}, COUNT(*), SUM(rating)
+    FROM {table}
+    WHERE {subject_column} IS NOT NULL
+    GROUP BY {subject_column}
+    """
+
+
+# Listings per category for one kind of listing (events also per day), kept
+# current by triggers so the facet counts never scan the listing table. Rows that
+# drop to zero are removed. Returns the triggers and the statement that loads the
+# existing listings (replacing rows, so it can be rerun).
+def category_counts(kind, table, day_column=None):
+    day = f"{{row}}.{day_column}" if day_column else "''"
+    changed = f"OR old.{day_column} IS NOT new.{day_column}" if day_column else ""
+
+    def add(row):
+        return f"""
+            INSERT INTO CategoryCounts (kind, day, category, listing_count)
+            SELECT '{kind}', {day.format(row=row)}, {row}.category, 1 WHERE {row}.category <> ''
+            ON CONFLICT (kind, day, category) DO UPDATE SET listing_count = listing_count + 1;
+        """
+
+    def remove(row):
+        return f"""
+            UPDATE CategoryCounts SET listing_count = listing_count - 1
+            WHERE kind = '{kind}' AND day = {day.format(row=row)} AND category = {row}.category;
+            DELETE FROM CategoryCounts
+            WHERE kind = '{kind}' AND day = {day.format(row=row)} AND category = {row}.category AND listing_count <= 0;
+        """
+
+    return [
+        f"""
+        INSERT OR REPLACE INTO CategoryCounts (kind, day, category, listing_count)
+        SELECT '{kind}', {day.format(row=table)}, category, COUNT(*)
+        FROM {table}
+        WHERE category <> ''
+        GROUP BY {day.format(row=table)}, category
+        """,
+        f"CREATE TRIGGER IF NOT EXISTS {table}_category_insert AFTER INSERT ON {table} BEGIN {add('new')} END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_category_delete AFTER DELETE ON {table} BEGIN {remove('old')} END",
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_category_update AFTER UPDATE ON {table}
+        WHEN old.category IS NOT new.category {changed}
+        BEGIN
+            {remove('old')}
+            {add('new')}
+        END
+        """,
+    ]
+
+
+def now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+# Each migration is (version, name, statements, backfills). Statements are SQL
+# strings or callables taking the connection; they run in a single transaction
+# together with the version bump. Backfills run afterwards in small batches.
+# Versions are applied in order and recorded in the schema_version table, so a
+# migration runs exactly once per database.
+MIGRATIONS = [
+    (1, 'hot lookup indexes', [
+        # reserve_resource / reserve_space overlap checks and the "Reserved" status subqueries
+        "CREATE INDEX IF NOT EXISTS idx_resource_reservations_resource_dates ON ResourceReservations (resource_id, reservation_start_date, reservation_end_date)",
+        "CREATE INDEX IF NOT EXISTS idx_space_reservations_space_dates ON SpaceReservations (space_id, reservation_start_date, reservation_end_date)",
+
+        # reserved_resources / reserved_spaces and the dashboard's upcoming reservations
+        "CREATE INDEX IF NOT EXISTS idx_resource_reservations_user_end ON ResourceReservations (user_id, reservation_end_date)",
+        "CREATE INDEX IF NOT EXISTS idx_space_reservations_user_end ON SpaceReservations (user_id, reservation_end_date)",
+
+        # Dashboard notifications (reservations on my items in the last 24 hours)
+        "CREATE INDEX IF NOT EXISTS idx_resource_reservations_resource_created ON ResourceReservations (resource_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_space_reservations_space_created ON SpaceReservations (space_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_event_attendance_event_created ON EventAttendance (event_id, created_at)",
+
+        # attend_event duplicate check, events_attending and the dashboard
+        "CREATE INDEX IF NOT EXISTS idx_event_attendance_event_user ON EventAttendance (event_id, user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_event_attendance_user_created ON EventAttendance (user_id, created_at)",
+
+        # inbox and conversation (both directions of a thread)
+        "CREATE INDEX IF NOT EXISTS idx_messages_sender_receiver_time ON Messages (sender_id, receiver_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_receiver_sender_time ON Messages (receiver_id, sender_id, timestamp)",
+
+        # my_*_reviews and top-rated users
+        "CREATE INDEX IF NOT EXISTS idx_reviews_user_time ON Reviews (user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_resource_reviews_resource_time ON ResourceReviews (resource_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_space_reviews_space_time ON SpaceReviews (space_id, timestamp)",
+
+        # my_* listings and the homepage's newest listings
+        "CREATE INDEX IF NOT EXISTS idx_resources_user_posted ON Resources (user_id, date_posted)",
+        "CREATE INDEX IF NOT EXISTS idx_spaces_user_posted ON Spaces (user_id, date_posted)",
+        "CREATE INDEX IF NOT EXISTS idx_events_user_date ON Events (user_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_resources_posted ON Resources (date_posted)",
+        "CREATE INDEX IF NOT EXISTS idx_spaces_posted ON Spaces (date_posted)",
+        "CREATE INDEX IF NOT EXISTS idx_events_date ON Events (date)",
+    ], []),
+    (2, 'backfill reservation created_at', [], [
+        backfill('ResourceReservations', 'created_at', now),
+        backfill('SpaceReservations', 'created_at', now),
+        backfill('EventAttendance', 'created_at', now),
+    ]),
+    (3, 'drop legacy Notifications table', [
+        "DROP TABLE IF EXISTS Notifications",
+    ], []),
+    (4, 'full-text search indexes',
+        listing_fts('Resources', 'resource_id', ['title', 'description', 'category', 'availability'])
+        + listing_fts('Spaces', 'space_id', ['title', 'description', 'category', 'availability'])
+        + listing_fts('Events', 'event_id', ['title', 'description', 'category'])
+        + review_fts('Reviews', 'user_id', 'Users', 'user_id', 'name')
+        + review_fts('ResourceReviews', 'resource_id', 'Resources', 'resource_id', 'title')
+        + review_fts('SpaceReviews', 'space_id', 'Spaces', 'space_id', 'title'),
+        []),
+    (5, 'reservation overlap indexes', [
+        # Lead with the end date so an overlap check only visits reservations that
+        # have not ended yet, instead of the item's whole booking history
+        "DROP INDEX IF EXISTS idx_resource_reservations_resource_dates",
+        "DROP INDEX IF EXISTS idx_space_reservations_space_dates",
+        "CREATE INDEX IF NOT EXISTS idx_resource_reservations_resource_end_start ON ResourceReservations (resource_id, reservation_end_date, reservation_start_date)",
+        "CREATE INDEX IF NOT EXISTS idx_space_reservations_space_end_start ON SpaceReservations (space_id, reservation_end_date, reservation_start_date)",
+    ], []),
+    (6, 'materialized availability', [
+        # 1 while a reservation covers today; kept current by availability.py
+        add_column('Resources', 'is_reserved', 'INTEGER NOT NULL DEFAULT 0'),
+        add_column('Spaces', 'is_reserved', 'INTEGER NOT NULL DEFAULT 0'),
+        # The day is_reserved was last recomputed for (a single row)
+        "CREATE TABLE IF NOT EXISTS AvailabilityRollover (day TEXT NOT NULL)",
+    ], []),
+    (7, 'keyset pagination indexes', [
+        # Conversation pages walk each direction of a thread by message_id
+        "CREATE INDEX IF NOT EXISTS idx_messages_sender_receiver_id ON Messages (sender_id, receiver_id, message_id)",
+        # view_all_reviews lists reviews newest first
+        "CREATE INDEX IF NOT EXISTS idx_reviews_time ON Reviews (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_resource_reviews_time ON ResourceReviews (timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_space_reviews_time ON SpaceReviews (timestamp)",
+    ], []),
+    (8, 'rating totals', [
+        # Review count and rating sum per reviewed user, resource or space, kept
+        # current by ratings.py. score is a Bayesian average that starts every
+        # subject at 5 phantom reviews of 3 stars, so one 5-star review cannot
+        # outrank a long record of good ones.
+        """
+        CREATE TABLE IF NOT EXISTS RatingStats (
+            subject_type TEXT NOT NULL,
+            subject_id INTEGER NOT NULL,
+            review_count INTEGER NOT NULL,
+            rating_sum INTEGER NOT NULL,
+            score REAL GENERATED ALWAYS AS ((rating_sum + 3.0 * 5) / (review_count + 5)) VIRTUAL,
+            PRIMARY KEY (subject_type, subject_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_rating_stats_type_score ON RatingStats (subject_type, score)",
+        rating_totals('user', 'Reviews', 'user_id'),
+        rating_totals('resource', 'ResourceReviews', 'resource_id'),
+        rating_totals('space', 'SpaceReviews', 'space_id'),
+    ], []),
+    (9, 'conversation summaries', [
+        # One row per user per conversation partner, kept current by messaging.py,
+        # so the inbox reads one row per conversation instead of every message
+        """
+        CREATE TABLE IF NOT EXISTS Conversations (
+            user_id INTEGER NOT NULL,
+            other_user_id INTEGER NOT NULL,
+            last_message_id INTEGER NOT NULL,
+            last_message_time TEXT NOT NULL,
+            last_sender_id INTEGER NOT NULL,
+            preview TEXT NOT NULL,
+            unread_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, other_user_id),
+            FOREIGN KEY (user_id) REFERENCES Users(user_id),
+            FOREIGN KEY (other_user_id) REFERENCES Users(user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_conversations_user_time ON Conversations (user_id, last_message_time, other_user_id)",
+        # Summarize existing threads from their latest message. Read state was never
+        # tracked, so existing messages start out read.
+        f"""
+        INSERT OR REPLACE INTO Conversations (user_id, other_user_id, last_message_id, last_message_time, last_sender_id, preview, unread_count)
+        SELECT t.user_id, t.other_user_id, m.message_id, m.timestamp, m.sender_id, substr(m.content, 1, {PREVIEW_LENGTH}), 0
+        FROM (
+            SELECT user_id, other_user_id, MAX(message_id) AS message_id
+            FROM (
+                SELECT sender_id AS user_id, receiver_id AS other_user_id, message_id FROM Messages
+                UNION ALL
+                SELECT receiver_id, sender_id, message_id FROM Messages
+            )
+            GROUP BY user_id, other_user_id
+        ) t
+        JOIN Messages m ON m.message_id = t.message_id
+        """,
+    ], []),
+    (10, 'image variants', [
+        # Thumbnails and WebP copies of each stored image, written by images.py and
+        # used for srcset. format is 'original' (the image's own format) or 'webp'.
+        """
+        CREATE TABLE IF NOT EXISTS ImageVariants (
+            image_path TEXT NOT NULL,
+            format TEXT NOT NULL,
+            width INTEGER NOT NULL,
+            path TEXT NOT NULL,
+            PRIMARY KEY (image_path, format, width)
+        ) WITHOUT ROWID
+        """,
+    ], []),
+    (11, 'job queue', [
+        # Background jobs run by jobs.py workers. Times are Unix timestamps.
+        """
+        CREATE TABLE IF NOT EXISTS Jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,  -- queued, running, done or failed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            enqueued_at REAL NOT NULL,
+            run_after REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            error TEXT
+        )
+        """,
+        # Workers take the next due job; stats and pruning read finished jobs by time
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_run_after ON Jobs (status, run_after)",
+        "CREATE INDEX IF NOT EXISTS idx_jobs_status_finished ON Jobs (status, finished_at)",
+    ], []),
+    (12, 'blob store', [
+        # One row per distinct uploaded image in blobstore.py, with the number of
+        # users, listings and events that show it
+        """
+        CREATE TABLE IF NOT EXISTS Blobs (
+            digest TEXT PRIMARY KEY,
+            path TEXT NOT NULL UNIQUE,
+            ref_count INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ], []),
+    (13, 'category counts', [
+        # Listings per category (events per category and day) for the filter
+        # facets, kept current by triggers. day is '' for resources and spaces.
+        """
+        CREATE TABLE IF NOT EXISTS CategoryCounts (
+            kind TEXT NOT NULL,
+            day TEXT NOT NULL,
+            category TEXT NOT NULL,
+            listing_count INTEGER NOT NULL,
+            PRIMARY KEY (kind, day, category)
+        ) WITHOUT ROWID
+        """,
+        *category_counts('resource', 'Resources'),
+        *category_counts('space', 'Spaces'),
+        *category_counts('event', 'Events', 'date'),
+        # Category filters, in the order each page lists its rows
+        "CREATE INDEX IF NOT EXISTS idx_resources_category_posted ON Resources (category, date_posted)",
+        "CREATE INDEX IF NOT EXISTS idx_spaces_category_posted ON Spaces (category, date_posted)",
+        "CREATE INDEX IF NOT EXISTS idx_events_category_date ON Events (category, date)",
+    ], []),
+    (14, 'narrow listing index triggers', [
+        # Version 4 re-indexed a listing on any update, so every is_reserved write
+        # rewrote its full-text row
+        "DROP TRIGGER IF EXISTS ResourcesFTS_update",
+        "DROP TRIGGER IF EXISTS SpacesFTS_update",
+        "DROP TRIGGER IF EXISTS EventsFTS_update",
+        listing_fts_update('Resources', 'resource_id', ['title', 'description', 'category', 'availability']),
+        listing_fts_update('Spaces', 'space_id', ['title', 'description', 'category', 'availability']),
+        listing_fts_update('Events', 'event_id', ['title', 'description', 'category']),
+    ], []),
+]
+
+
+def current_version(con):
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+    """)
+    row = con.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def pending_migrations(con):
+    version = current_version(con)
+    return [m for m in MIGRATIONS if m[0] > version]
+
+
+# sqlite3 only opens implicit transactions for DML, so begin explicitly to keep
+# DDL atomic
+def run_in_transaction(con, statements, version=None, name=None):
+    con.execute("BEGIN")
+    try:
+        for statement in statements:
+            if callable(statement):
+                statement(con)
+            else:
+                con.execute(statement)
+        if version is not None:
+            con.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, now())
+            )
+    except Exception:
+        con.rollback()
+        raise
+    con.commit()
+
+
+# Create any missing base tables, then apply every pending migration in order.
+# Safe to run repeatedly: an up-to-date database is left untouched.
+def migrate(con):
+    if current_version(con) == 0:
+        run_in_transaction(con, SCHEMA)
+
+    applied = []
+    for version, name, statements, backfills in pending_migrations(con):
+        # Statements must be idempotent: if a backfill is interrupted the version is
+        # not recorded and the whole migration is retried on the next run
+        run_in_transaction(con, statements)
+        for run in backfills:
+            run(con)
+        run_in_transaction(con, [], version, name)
+        applied.append((version, name))
+    return applied
+
+
+if __name__ == '__main__':
+    connection = sqlite3.connect(sys.argv[1] if len(sys.argv) > 1 else DATABASE)
+    for version, name in migrate(connection):
+        print(f"Applied migration {version}: {name}")
+    print(f"Database is at schema version {current_version(connection)}.")
+    connection.close()
@@ -0,0 +1,108 @@
+import base64
+import json
+
+from flask import request, url_for
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+# Cursors are the sort-key values of the first/last row on a page, packed into
+# an opaque URL-safe token
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(list(values)).encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        return None
+    # Sort keys are plain values; anything else (a tampered token) is no cursor
+    if not isinstance(values, list) or not all(isinstance(v, (str, int, float, type(None))) for v in values):
+        return None
+    return values
+
+
+class Page:
+    def __init__(self, rows, next_cursor=None, prev_cursor=None):
+        self.rows = rows
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+# Page size and position requested in the query string (?limit=, ?after=, ?before=)
+class PageRequest:
+    def __init__(self, key_count):
+        try:
+            size = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        except ValueError:
+            size = DEFAULT_PAGE_SIZE
+        self.size = max(1, min(size, MAX_PAGE_SIZE))
+
+        before = decode_cursor(request.args.get('before'))
+        after = decode_cursor(request.args.get('after'))
+        # Going backwards walks the sort order in reverse and flips the page afterwards
+        self.forward = before is None
+        self.cursor = after if self.forward else before
+        # A cursor with the wrong number of keys starts over from the first page
+        if self.cursor is not None and len(self.cursor) != key_count:
+            self.cursor = None
+            self.forward = True
+
+    # Turn the size + 1 rows fetched in walk order into a page with its cursors
+    def page(self, rows, key):
+        more = len(rows) > self.size
+        rows = rows[:self.size]
+        if not self.forward:
+            rows.reverse()
+        if not rows:
+            return Page(rows)
+
+        first, last = encode_cursor(key(rows[0])), encode_cursor(key(rows[-1]))
+        if self.forward:
+            return Page(rows, last if more else None, first if self.cursor is not None else None)
+        return Page(rows, last, first if more else None)
+
+
+# Run a SELECT one page at a time, ordered by the given output columns (which
+# together must identify a row). Keyset pagination: each page is an index range
+# starting at the previous page's last row, so deep pages cost the same as the first.
+# Columns named in `hidden` (e.g. a search rank) must come last in the select list;
+# they are used for the cursors and then dropped from the returned rows.
+def paginate(con, sql, params, keys, descending=True, hidden=()):
+    page_request = PageRequest(len(keys))
+    walk_descending = descending == page_request.forward
+    order = 'DESC' if walk_descending else 'ASC'
+
+    where = ''
+    args = list(params)
+    if page_request.cursor is not None:
+        where = f"WHERE ({', '.join(keys)}) {'<' if walk_descending else '>'} ({', '.join('?' * len(keys))})"
+        args += page_request.cursor
+
+    cur = con.execute(f"""
+        SELECT * FROM ({sql})
+        {where}
+        ORDER BY {', '.join(f'{k} {order}' for k in keys)}
+        LIMIT ?
+    """, args + [page_request.size + 1])
+
+    columns = [d[0] for d in cur.description]
+    positions = [columns.index(k) for k in keys]
+    page = page_request.page(cur.fetchall(), lambda row: [row[i] for i in positions])
+    if hidden:
+        page.rows = [row[:-len(hidden)] for row in page.rows]
+    return page
+
+
+# Link to the current page's URL with a different position, keeping the other
+# query-string arguments (search text, page size)
+def page_url(**position):
+    args = request.args.to_dict()
+    args.pop('after', None)
+    args.pop('before', None)
+    args.update(position)
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
@@ -0,0 +1,193 @@
+import hmac
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from flask import g, request
+
+# Where profiles are written, and how many are kept (oldest deleted first)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_KEEP = 100
+# Seconds between samples of the profiled request's stack
+SAMPLE_INTERVAL = 0.002
+# Requests carrying this header with the PROFILE_TOKEN value are profiled
+PROFILE_HEADER = 'X-Profile'
+
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+UNSAFE_NAME = re.compile(r'[^A-Za-z0-9_.-]+')
+
+# Numbers this process's profiles, so names made in the same second differ
+_sequence = itertools.count(1)
+
+
+# Samples one thread's Python stack from a background thread until stopped.
+# The profiled code runs untouched (no tracing hooks), so the cost is one stack
+# walk per interval.
+class Sampler:
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        # (stack from the outermost frame, milliseconds it stands for)
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = (time.perf_counter() - self.started) * 1000
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            stack.reverse()
+            self.samples.append((tuple(stack), (now - last) * 1000))
+            last = now
+
+
+# Brendan Gregg's collapsed-stack format: one "outer;...;inner weight" line per
+# distinct stack, weight in microseconds. Input for flamegraph.pl, speedscope
+# and most flame graph viewers.
+def collapsed(samples):
+    totals = {}
+    for stack, ms in samples:
+        key = ';'.join(f"{name} ({os.path.basename(filename)}:{line})" for name, filename, line in stack)
+        totals[key] = totals.get(key, 0) + ms
+    return ''.join(f"{key} {round(ms * 1000)}\n" for key, ms in sorted(totals.items()))
+
+
+# speedscope's sampled-profile JSON, which keeps the samples in time order
+def speedscope(samples, name, elapsed):
+    frames = []
+    index = {}
+    stacks = []
+    for stack, _ in samples:
+        indices = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+            indices.append(index[frame])
+        stacks.append(indices)
+    return {
+        "$schema": SPEEDSCOPE_SCHEMA,
+        "name": name,
+        "exporter": "profiling.py",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": elapsed,
+            "samples": stacks,
+            "weights": [ms for _, ms in samples],
+        }],
+    }
+
+
+# Opt-in request profiling. A request is profiled when it carries the
+# X-Profile header with the configured token (PROFILE_TOKEN), or at random with
+# probability PROFILE_SAMPLE_RATE (at most one random profile at a time per
+# process). Each profile is written as <name>.collapsed and <name>.speedscope.json
+# to PROFILE_DIR, and the name is returned in the X-Profile header. When neither
+# setting is on, a request costs two config lookups.
+class RequestProfiler:
+    def __init__(self, app, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.app = app
+        self.directory = directory
+        self.keep = keep
+        self._sampling = threading.Lock()
+        self._files = threading.Lock()
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._stop)
+
+    def _wanted(self):
+        token = self.app.config.get('PROFILE_TOKEN')
+        rate = self.app.config.get('PROFILE_SAMPLE_RATE')
+        if not token and not rate:
+            return None
+        header = request.headers.get(PROFILE_HEADER)
+        if token and header and hmac.compare_digest(header, token):
+            return 'requested'
+        if rate and random.random() < rate and self._sampling.acquire(blocking=False):
+            return 'sampled'
+        return None
+
+    def _start(self):
+        reason = self._wanted()
+        if reason is None:
+            return
+        sampler = Sampler(threading.get_ident())
+        g.profile = (sampler, reason, self._name())
+        sampler.start()
+
+    def _name(self):
+        endpoint = UNSAFE_NAME.sub('_', request.endpoint or 'unmatched')
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{os.getpid()}-{next(_sequence)}"
+
+    def _finish(self, response):
+        profile = g.get('profile')
+        if profile is not None:
+            response.headers[PROFILE_HEADER] = profile[2]
+        return response
+
+    def _stop(self, exception):
+        profile = g.pop('profile', None)
+        if profile is None:
+            return
+        sampler, reason, name = profile
+        sampler.stop()
+        if reason == 'sampled':
+            self._sampling.release()
+        try:
+            self.write(name, sampler)
+        except OSError as e:
+            self.app.logger.warning("Could not write profile %s: %s", name, e)
+            return
+        self.app.logger.info("Profiled %s %s (%s): %.1f ms, %s samples -> %s",
+                             request.method, request.path, reason, sampler.elapsed, len(sampler.samples),
+                             os.path.join(self.directory, name))
+
+    def write(self, name, sampler):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        with open(path + '.collapsed', 'w') as f:
+            f.write(collapsed(sampler.samples))
+        with open(path + '.speedscope.json', 'w') as f:
+            json.dump(speedscope(sampler.samples, f"{request.method} {request.path}", sampler.elapsed), f)
+        self.rotate()
+
+    # Delete the oldest profiles beyond the newest `keep`
+    def rotate(self):
+        with self._files:
+            names = sorted(
+                (entry for entry in os.scandir(self.directory) if entry.name.endswith('.collapsed')),
+                key=lambda entry: entry.stat().st_mtime
+            )
+            for entry in names[:max(0, len(names) - self.keep)]:
+                stem = entry.path[:-len('.collapsed')]
+                for path in (entry.path, stem + '.speedscope.json'):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
@@ -0,0 +1,211 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from flask import g, request
+
+# Statements slower than this are logged with their query plan
+SLOW_QUERY_MS = 50
+# The same statement run this many times in one request is probably a query in
+# a loop (N+1) that should be a join or an IN (...)
+N_PLUS_ONE_THRESHOLD = 5
+# Slow queries kept for inspection (QueryStats.slow_queries)
+SLOW_LOG_SIZE = 100
+
+WHITESPACE = re.compile(r'\s+')
+LITERAL = re.compile(r"'(?:''|[^'])*'|\b\d+(?:\.\d+)?\b")
+
+# Queries of the request running on this thread, if it is being recorded
+_current = threading.local()
+
+
+# Statement text with literals replaced by ? and whitespace collapsed, so runs of
+# the same statement compare equal
+def normalize(sql):
+    return WHITESPACE.sub(' ', LITERAL.sub('?', sql)).strip()
+
+
+class Query:
+    __slots__ = ('sql', 'params', 'ms', 'rows')
+
+    def __init__(self, sql, params, ms, rows):
+        self.sql = sql
+        self.params = params
+        self.ms = ms
+        self.rows = rows
+
+
+def _recording():
+    return getattr(_current, 'queries', None)
+
+
+# Cursor that adds the time spent fetching and the rows fetched to its query
+class InstrumentedCursor(sqlite3.Cursor):
+    query = None
+
+    # `recorded` are the parameters kept for EXPLAIN: the statement's own, or none
+    # for executemany
+    def _run(self, method, sql, params, recorded):
+        queries = _recording()
+        if queries is None:
+            return method(sql, params)
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            self.query = Query(sql, recorded, (time.perf_counter() - start) * 1000, max(self.rowcount, 0))
+            queries.append(self.query)
+
+    def execute(self, sql, params=()):
+        return self._run(super().execute, sql, params, params)
+
+    def executemany(self, sql, params):
+        return self._run(super().executemany, sql, params, ())
+
+    def _fetched(self, start, rows):
+        if self.query is not None:
+            self.query.ms += (time.perf_counter() - start) * 1000
+            self.query.rows += rows
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(start, row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._fetched(start, len(rows))
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(start, len(rows))
+        return rows
+
+    def __next__(self):
+        start = time.perf_counter()
+        row = super().__next__()
+        self._fetched(start, 1)
+        return row
+
+
+# Connection class for the pool (db.py): every statement run through it while a
+# request is being recorded is timed. Outside a request it costs one lookup.
+class InstrumentedConnection(sqlite3.Connection):
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+
+# Records the SQL each request runs: per-request totals as a Server-Timing entry
+# (when SERVER_TIMING is on) and one JSON log line, a log of slow statements with
+# their query plans, and warnings for statements repeated within a request.
+# `connection` returns the request's connection, if it has one, for the plans.
+class QueryStats:
+    def __init__(self, app, connection, slow_ms=SLOW_QUERY_MS, repeat_threshold=N_PLUS_ONE_THRESHOLD):
+        self.app = app
+        self.connection = connection
+        self.slow_ms = slow_ms
+        self.repeat_threshold = repeat_threshold
+        self.slow_queries = deque(maxlen=SLOW_LOG_SIZE)
+        self._lock = threading.Lock()
+        self._routes = {}
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._stop)
+
+    def _start(self):
+        _current.queries = []
+        g.query_start = time.perf_counter()
+
+    def _stop(self, exception):
+        _current.queries = None
+
+    def _finish(self, response):
+        queries = _recording()
+        if queries is None:
+            return response
+        _current.queries = None
+        route = request.endpoint or request.path
+        count = len(queries)
+        query_ms = sum(q.ms for q in queries)
+        rows = sum(q.rows for q in queries)
+
+        if self.app.config.get('SERVER_TIMING'):
+            entry = f'sql;dur={query_ms:.1f};desc="{count} {"query" if count == 1 else "queries"}"'
+            existing = response.headers.get('Server-Timing')
+            response.headers['Server-Timing'] = f"{existing}, {entry}" if existing else entry
+
+        repeated = self._repeated(queries)
+        for sql, times in repeated:
+            self.app.logger.warning("Possible N+1 in %s: ran %s times: %s", route, times, sql)
+        for query in queries:
+            if query.ms > self.slow_ms:
+                self._log_slow(route, query)
+
+        self.app.logger.info(json.dumps({
+            "event": "request",
+            "route": route,
+            "method": request.method,
+            "status": response.status_code,
+            "ms": round((time.perf_counter() - g.query_start) * 1000, 1),
+            "queries": count,
+            "query_ms": round(query_ms, 1),
+            "rows": rows,
+            "repeated": [sql for sql, _ in repeated],
+        }))
+        with self._lock:
+            requests, total_count, total_ms = self._routes.get(route, (0, 0, 0.0))
+            self._routes[route] = (requests + 1, total_count + count, total_ms + query_ms)
+        return response
+
+    # (normalized statement, times run) for statements run repeatedly in the request
+    def _repeated(self, queries):
+        counts = {}
+        for query in queries:
+            sql = normalize(query.sql)
+            counts[sql] = counts.get(sql, 0) + 1
+        return [(sql, times) for sql, times in counts.items() if times >= self.repeat_threshold]
+
+    def _log_slow(self, route, query):
+        plan = self.explain(query)
+        self.slow_queries.append({
+            "route": route,
+            "sql": normalize(query.sql),
+            "ms": round(query.ms, 1),
+            "rows": query.rows,
+            "plan": plan,
+            "at": time.time(),
+        })
+        self.app.logger.warning("Slow query in %s (%.1f ms, %s rows): %s\n%s",
+                                route, query.ms, query.rows, normalize(query.sql), '\n'.join(plan))
+
+    # EXPLAIN QUERY PLAN of a recorded statement, on the request's connection
+    def explain(self, query):
+        con = self.connection()
+        if con is None or not query.sql.lstrip().upper().startswith(('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')):
+            return []
+        try:
+            return [row[3] for row in con.execute("EXPLAIN QUERY PLAN " + query.sql, query.params)]
+        except sqlite3.Error as e:
+            return [f"(no plan: {e})"]
+
+    # {route: {"requests", "avg_queries", "avg_query_ms"}}, most query time first
+    def stats(self):
+        with self._lock:
+            items = list(self._routes.items())
+        return {
+            route: {"requests": requests, "avg_queries": count / requests, "avg_query_ms": ms / requests}
+            for route, (requests, count, ms) in sorted(items, key=lambda item: -item[1][2])
+        }
@@ -0,0 +1,54 @@
+import sqlite3
+import sys
+
+from migrations import DATABASE
+
+# Review table and reviewed-subject column for each kind of rated subject
+KINDS = {
+    'user': ('Reviews', 'user_id'),
+    'resource': ('ResourceReviews', 'resource_id'),
+    'space': ('SpaceReviews', 'space_id'),
+}
+
+
+# Count a new review in its subject's totals. Call inside the transaction that
+# inserts the review. RatingStats.score is derived from the totals by the schema.
+def record_review(con, kind, subject_id, rating):
+    con.execute("""
+        INSERT INTO RatingStats (subject_type, subject_id, review_count, rating_sum)
+        VALUES (?, ?, 1, ?)
+        ON CONFLICT(subject_type, subject_id) DO UPDATE SET
+            review_count = review_count + 1,
+            rating_sum = rating_sum + excluded.rating_sum
+    """, (kind, subject_id, rating))
+
+
+# Recompute every subject's totals from the review tables
+def rebuild(con):
+    con.execute("BEGIN IMMEDIATE")
+    try:
+        con.execute("DELETE FROM RatingStats")
+        for kind, (table, column) in KINDS.items():
+            con.execute(f"""
+                INSERT INTO RatingStats (subject_type, subject_id, review_count, rating_sum)
+                SELECT ?, {column}, COUNT(*), SUM(rating)
+                FROM {table}
+                WHERE {column} IS NOT NULL
+                GROUP BY {column}
+            """, (kind,))
+    except Exception:
+        con.rollback()
+        raise
+    con.commit()
+
+
+# python ratings.py rebuild [database]
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] != 'rebuild':
+        print("usage: python ratings.py rebuild [database]")
+        sys.exit(2)
+    connection = sqlite3.connect(sys.argv[2] if len(sys.argv) > 2 else DATABASE)
+    rebuild(connection)
+    count = connection.execute("SELECT COUNT(*) FROM RatingStats").fetchone()[0]
+    connection.close()
+    print(f"Rating totals rebuilt for {count} subjects.")
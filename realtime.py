@@ -0,0 +1,85 @@
+import sqlite3
+import threading
+import time
+
+# Seconds between checks for messages sent by other worker processes
+POLL_INTERVAL = 0.5
+
+
+# A streaming request waiting for new messages for one user
+class Subscription:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._event = threading.Event()
+
+    def notify(self):
+        self._event.set()
+
+    # Block until a message for this user may have arrived. Returns False on
+    # timeout. Callers re-read the database afterwards, so a notification that
+    # lands between waking up and clearing the flag is not lost.
+    def wait(self, timeout):
+        fired = self._event.wait(timeout)
+        self._event.clear()
+        return fired
+
+
+# In-process fanout of new messages to the streaming requests of their sender and
+# receiver. Messages sent through this worker are published right after their
+# commit. Other workers' messages are picked up by a background thread that
+# follows the Messages rowid range, so the shared SQLite file acts as the broker
+# between processes. The thread only runs while someone is subscribed.
+class MessageBroker:
+    def __init__(self, database, poll_interval=POLL_INTERVAL):
+        self.database = database
+        self.poll_interval = poll_interval
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll, name='message-broker', daemon=True)
+                self._poller.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscribers.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscribers[subscription.user_id]
+
+    def publish(self, sender_id, receiver_id):
+        with self._lock:
+            user_ids = {int(user_id) for user_id in (sender_id, receiver_id) if user_id is not None}
+            subscriptions = [s for user_id in user_ids for s in self._subscribers.get(user_id, ())]
+        for subscription in subscriptions:
+            subscription.notify()
+
+    def _poll(self):
+        con = sqlite3.connect(self.database)
+        try:
+            last_id = con.execute("SELECT MAX(message_id) FROM Messages").fetchone()[0] or 0
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._poller = None
+                        return
+                try:
+                    new_messages = con.execute(
+                        "SELECT message_id, sender_id, receiver_id FROM Messages WHERE message_id > ? ORDER BY message_id",
+                        (last_id,)
+                    ).fetchall()
+                except sqlite3.OperationalError:
+                    new_messages = []  # Database busy; try again on the next tick
+                for message_id, sender_id, receiver_id in new_messages:
+                    last_id = message_id
+                    self.publish(sender_id, receiver_id)
+                time.sleep(self.poll_interval)
+        finally:
+            con.close()
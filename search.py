@@ -0,0 +1,13 @@
+import re
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+
+# Turn free text from a search box into an FTS5 MATCH expression: every word has
+# to appear (as a prefix) in some indexed column. Returns None when the text has
+# no searchable words.
+def match_expression(text):
+    words = WORD.findall(text or '')
+    if not words:
+        return None
+    return ' '.join(f'"{word}"*' for word in words)
@@ -0,0 +1,88 @@
+// Live updates for the newest page of a conversation. New messages arrive over
+// Server-Sent Events, or by long polling where EventSource is unavailable, and
+// the form posts in the background instead of reloading the page. When the
+// server has no room for another live connection (503), the page checks the
+// messages URL every few seconds instead; its ETag makes idle checks cheap.
+(function () {
+    var list = document.querySelector('.message-list');
+    var form = document.querySelector('.message-form');
+    if (!list || !list.dataset.streamUrl) {
+        return;
+    }
+    var after = parseInt(list.dataset.after, 10) || 0;
+
+    function line(tag, className, text) {
+        var element = document.createElement(tag);
+        element.className = className;
+        element.textContent = text;
+        return element;
+    }
+
+    function append(message) {
+        if (message.message_id <= after) {
+            return;
+        }
+        after = message.message_id;
+        var container = document.createElement('div');
+        container.className = 'message-container ' + (message.sent ? 'sent' : 'received');
+        container.appendChild(line('p', 'sender-name', message.sent ? 'You' : list.dataset.otherName));
+        container.appendChild(line('p', 'message-content', message.content));
+        container.appendChild(line('span', 'timestamp', message.timestamp));
+        list.appendChild(container);
+        list.scrollTop = list.scrollHeight;
+    }
+
+    function check() {
+        fetch(list.dataset.messagesUrl + '?after=' + after, {credentials: 'same-origin'})
+            .then(function (response) { return response.ok ? response.json() : []; })
+            .then(function (messages) { messages.forEach(append); })
+            .catch(function () {})
+            .then(function () { setTimeout(check, 5000); });
+    }
+
+    if (window.EventSource) {
+        // On reconnect the browser resumes from the last event id by itself. It
+        // gives up (CLOSED) only when the server refuses the stream.
+        var source = new EventSource(list.dataset.streamUrl + '?after=' + after);
+        source.onmessage = function (event) {
+            append(JSON.parse(event.data));
+        };
+        source.onerror = function () {
+            if (source.readyState === EventSource.CLOSED) {
+                check();
+            }
+        };
+    } else {
+        (function poll() {
+            fetch(list.dataset.pollUrl + '?after=' + after, {credentials: 'same-origin'})
+                .then(function (response) {
+                    if (response.status === 503) {
+                        check();
+                        return null;
+                    }
+                    return response.json();
+                })
+                .then(function (messages) {
+                    if (messages) {
+                        messages.forEach(append);
+                        poll();
+                    }
+                })
+                .catch(function () { setTimeout(poll, 3000); });
+        })();
+    }
+
+    form.addEventListener('submit', function (event) {
+        event.preventDefault();
+        fetch(form.action, {
+            method: 'POST',
+            body: new FormData(form),
+            headers: {'Accept': 'application/json'},
+            credentials: 'same-origin'
+        }).then(function (response) {
+            if (response.ok) {
+                form.reset();
+            }
+        });
+    });
+})();
@@ -0,0 +1,72 @@
+import os
+import threading
+import time
+
+from flask import before_render_template, template_rendered
+from jinja2 import FileSystemBytecodeCache
+
+# Compiled templates are kept here between processes and restarts
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', '.jinja_cache')
+# Renders slower than this are logged
+SLOW_RENDER_MS = 50
+
+
+# Production template setup: compiled bytecode is shared through a directory, so a
+# fresh worker loads templates instead of compiling them; templates are never
+# re-checked against the files on disk; and every template is loaded at boot.
+# With gunicorn's preload_app the workers inherit the loaded templates.
+def configure_production(app, cache_dir=TEMPLATE_CACHE_DIR):
+    os.makedirs(cache_dir, exist_ok=True)
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    env = app.jinja_env
+    env.auto_reload = False
+    env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    return preload(app)
+
+
+# Load (compiling if needed) every template so no request pays for it. Returns the count.
+def preload(app):
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+# Per-template render counts and times for this process, fed by Flask's
+# template signals. Each of `listeners` is also called with (template name, ms).
+class RenderStats:
+    def __init__(self, app, slow_ms=SLOW_RENDER_MS):
+        self.app = app
+        self.slow_ms = slow_ms
+        self.listeners = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._templates = {}
+        before_render_template.connect(self._started, app, weak=False)
+        template_rendered.connect(self._finished, app, weak=False)
+
+    def _started(self, sender, template, context, **extra):
+        self._local.start = time.perf_counter()
+
+    def _finished(self, sender, template, context, **extra):
+        start = getattr(self._local, 'start', None)
+        if start is None:
+            return
+        self._local.start = None
+        ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            count, total, slowest = self._templates.get(template.name, (0, 0.0, 0.0))
+            self._templates[template.name] = (count + 1, total + ms, max(slowest, ms))
+        for listener in self.listeners:
+            listener(template.name, ms)
+        if ms > self.slow_ms:
+            self.app.logger.warning("Rendering %s took %.1f ms", template.name, ms)
+
+    # {template: {"renders", "avg_ms", "max_ms"}}, slowest on average first
+    def stats(self):
+        with self._lock:
+            items = list(self._templates.items())
+        return {
+            name: {"renders": count, "avg_ms": total / count, "max_ms": slowest}
+            for name, (count, total, slowest) in sorted(items, key=lambda item: -item[1][1] / item[1][0])
+        }
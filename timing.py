@@ -0,0 +1,20 @@
+import time
+from contextlib import contextmanager
+
+
+# Wall-clock time spent in the named sections of a request, reported as a
+# Server-Timing header so browser dev tools can show where the time went
+class SectionTimer:
+    def __init__(self):
+        self.sections = []
+
+    @contextmanager
+    def section(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.sections.append((name, (time.perf_counter() - start) * 1000))
+
+    def header(self):
+        return ', '.join(f"{name};dur={ms:.1f}" for name, ms in self.sections)